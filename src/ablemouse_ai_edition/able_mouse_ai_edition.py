@@ -1,29 +1,51 @@
 import time
 import cv2
 import mediapipe as mp
-import pyautogui
 import numpy as np
 import socket
 import json
 import os
 import sys
+import math
+import threading
+import bisect
+import argparse
+import queue
+import select
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+
+if sys.platform == "win32":
+    # real pixels on every monitor, also with different scaling factors. Must be set before pyautogui
+    # is imported, otherwise pyautogui makes the process only system DPI aware
+    try:
+        import ctypes
+        ctypes.windll.shcore.SetProcessDpiAwareness(2)  # PROCESS_PER_MONITOR_DPI_AWARE
+    except Exception:
+        pass
+
+try:
+    import pyautogui
+except Exception as e:
+    # pyautogui needs a display server (e.g. it fails on a headless Linux box)
+    pyautogui = None
+    print(f"pyautogui is not available ({e}). The cursor will not be moved")
 
 # ============ LOAD CONFIGURATION ============
-def load_config():
-    """Load configuration from JSON file"""
+def get_config_path():
+    # Если запущено как скомпилированный EXE
+    if getattr(sys, 'frozen', False):
+        # sys.executable — это полный путь к вашему .exe файлу
+        base_path = os.path.dirname(sys.executable)
+    else:
+        # Обычный запуск .py скрипта
+        base_path = os.path.dirname(os.path.abspath(__file__))
 
-    def get_config_path():
-        # Если запущено как скомпилированный EXE
-        if getattr(sys, 'frozen', False):
-            # sys.executable — это полный путь к вашему .exe файлу
-            base_path = os.path.dirname(sys.executable)
-        else:
-            # Обычный запуск .py скрипта
-            base_path = os.path.dirname(os.path.abspath(__file__))
-
-        return os.path.join(base_path, 'able_mouse_ai_edition_config.json')
+    return os.path.join(base_path, 'able_mouse_ai_edition_config.json')
 
 
+def load_config():
+    """Load configuration from JSON file"""
     config_path = get_config_path()
 
     if not os.path.exists(config_path):
@@ -34,19 +56,33 @@ def load_config():
         with open(config_path, 'r', encoding='utf-8') as f:
             config = json.load(f)
         print("Configuration loaded successfully from config.json")
-        return config
+        return merge_with_default_config(config)
     except Exception as e:
         print(f"Error loading config.json: {e}. Using default settings.")
         return get_default_config()
 
 
+def merge_with_default_config(config):
+    """Fills sections and keys missing in an older config file with default values"""
+    for section, default_values in get_default_config().items():
+        config.setdefault(section, {})
+        for key, value in default_values.items():
+            config[section].setdefault(key, value)
+    return config
+
+
 def get_default_config():
     """Return default configuration if JSON file is missing"""
     return {
         "communication": {
             "use_menu_system": False,
             "menu_host": "localhost",
-            "menu_port": 12345
+            "menu_port": 12345,
+            "menu_transport": "tcp",
+            "menu_socket_path": "/tmp/ablemouse_menu.sock",
+            "outbox_size": 16,
+            "reconnect_min_delay": 0.5,
+            "reconnect_max_delay": 5.0
         },
         "main": {
             "camera": 0,
@@ -56,7 +92,9 @@ def get_default_config():
             "skip_x_threshold": 0.001,
             "skip_y_threshold": 0.001,
             "nose_center": True,
-            "last_action_display_time": 3.0
+            "last_action_display_time": 3.0,
+            "headless": False,
+            "status_log_interval": 10.0
         },
         "eye_and_mouth": {
             "left_eye_close_time_threshold": 1.5,
@@ -69,7 +107,16 @@ def get_default_config():
             "mouth_click_cooldown_duration": 0.5,
             "mouth_menu_selection_cooldown_duration": 0.8,
             "eye_close_threshold": 0.005,
-            "mouth_open_threshold": 0.004
+            "mouth_open_threshold": 0.004,
+            "openness_metric": "gap",
+            "eye_closed_ratio": 0.1,
+            "eye_open_ratio": 0.14,
+            "mouth_open_ratio": 0.1,
+            "mouth_closed_ratio": 0.06
+        },
+        "gestures": {
+            "signals": {},
+            "table": []
         },
         "filtering": {
             "filter_method": "smooth",
@@ -77,7 +124,65 @@ def get_default_config():
             "move_threshold_pixels": 2,
             "use_movement_threshold": True,
             "use_median_filter": True,
-            "median_filter_window": 10
+            "median_filter_window": 10,
+            "one_euro_min_cutoff": 1.0,
+            "one_euro_beta": 0.005,
+            "one_euro_d_cutoff": 1.0,
+            "kalman_process_noise": 10000000.0,
+            "kalman_measurement_noise": 100.0
+        },
+        "tracking": {
+            "use_roi_tracking": False,
+            "roi_padding": 0.4,
+            "roi_min_size": 160
+        },
+        "capture": {
+            "backend": "auto",
+            "width": 0,
+            "height": 0,
+            "fps": 0,
+            "fourcc": "",
+            "buffer_size": 0
+        },
+        "prediction": {
+            "use_latency_compensation": False,
+            "extra_horizon": 0.03,
+            "max_horizon": 0.1,
+            "max_offset_pixels": 80,
+            "velocity_smoothing": 0.5
+        },
+        "cursor_output": {
+            "use_cursor_thread": False,
+            "rate_hz": 120,
+            "backend": "pyautogui"
+        },
+        "screen": {
+            "area": "primary",
+            "edge_margin": 5,
+            "refresh_interval": 2.0
+        },
+        "mapping": {
+            "method": "nose",
+            "nose_x_range": [],
+            "nose_y_range": [],
+            "yaw_range": [-15.0, 15.0],
+            "pitch_range": [10.0, -10.0]
+        },
+        "power_saving": {
+            "enabled": False,
+            "idle_after": 5.0,
+            "idle_fps": 5,
+            "idle_when_still": True,
+            "motion_threshold_pixels": 40,
+            "idle_capture_fps": 0
+        },
+        "metrics": {
+            "show_overlay": False,
+            "update_interval": 1.0,
+            "history_size": 1000,
+            "frame_budget_ms": 33.3,
+            "endpoint_port": 0,
+            "file": ""
         }
     }
 
@@ -89,9 +194,18 @@ config = load_config()
 USE_MENU_SYSTEM = config["communication"]["use_menu_system"]  # Use False if you want to run AbleMouse AI edition without integration with AbleMouse Beyond Switch server https://github.com/aradzhabov/AbleMouse/
 MENU_HOST = config["communication"]["menu_host"]
 MENU_PORT = config["communication"]["menu_port"]
+MENU_TRANSPORT = config["communication"]["menu_transport"]  # "tcp", "unix" or "udp", must match the menu server
+if MENU_TRANSPORT == "unix" and not hasattr(socket, "AF_UNIX"):
+    print("Unix domain sockets are not supported on this system, using TCP")
+    MENU_TRANSPORT = "tcp"
+MENU_SOCKET_PATH = config["communication"]["menu_socket_path"]
+MENU_OUTBOX_SIZE = config["communication"]["outbox_size"]  # commands waiting to be sent, the oldest is dropped when full
+MENU_RECONNECT_MIN_DELAY = config["communication"]["reconnect_min_delay"]
+MENU_RECONNECT_MAX_DELAY = config["communication"]["reconnect_max_delay"]
 
 # ============ MAIN SETTINGS ============
-pyautogui.FAILSAFE = False
+if pyautogui:
+    pyautogui.FAILSAFE = False
 
 camera = config["main"]["camera"]
 bln_cam_mouse_control = config["main"]["cam_mouse_control"]
@@ -101,6 +215,8 @@ SKIP_X_THRESHOLD = config["main"]["skip_x_threshold"]
 SKIP_Y_THRESHOLD = config["main"]["skip_y_threshold"]
 bln_nose_center = config["main"]["nose_center"]
 LAST_ACTION_DISPLAY_TIME = config["main"]["last_action_display_time"]
+HEADLESS = config["main"]["headless"]  # no preview window and no overlay drawing
+STATUS_LOG_INTERVAL = config["main"]["status_log_interval"]
 
 # ============ EYE AND MOUTH CLOSURE TRACKING SETTINGS ============
 LEFT_EYE_CLOSE_TIME_THRESHOLD = config["eye_and_mouth"]["left_eye_close_time_threshold"]
@@ -114,6 +230,57 @@ MOUTH_CLICK_COOLDOWN_DURATION = config["eye_and_mouth"]["mouth_click_cooldown_du
 MOUTH_MENU_SELECTION_COOLDOWN_DURATION = config["eye_and_mouth"]["mouth_menu_selection_cooldown_duration"]
 EYE_CLOSE_THRESHOLD = config["eye_and_mouth"]["eye_close_threshold"]
 MOUTH_OPEN_THRESHOLD = config["eye_and_mouth"]["mouth_open_threshold"]
+# "aspect_ratio" - openness = eyelid (lip) distance / eye (mouth) width, does not depend on the distance
+# to the camera; "gap" - raw eyelid (lip) distance compared with the two thresholds above.
+# "gap" stays the default, so tuned thresholds keep working; --calibrate switches to "aspect_ratio"
+OPENNESS_METRIC = config["eye_and_mouth"]["openness_metric"]
+# closed below eye_closed_ratio, open again only above eye_open_ratio (hysteresis), same for the mouth
+EYE_CLOSED_RATIO = config["eye_and_mouth"]["eye_closed_ratio"]
+EYE_OPEN_RATIO = config["eye_and_mouth"]["eye_open_ratio"]
+MOUTH_OPEN_RATIO = config["eye_and_mouth"]["mouth_open_ratio"]
+MOUTH_CLOSED_RATIO = config["eye_and_mouth"]["mouth_closed_ratio"]
+
+# ============ GESTURE SETTINGS ============
+# A signal compares a measure of face landmarks (MediaPipe indices) with a threshold:
+#   "gap"          - distance between two landmarks along x or y
+#   "aspect_ratio" - mean distance of the "vertical" landmark pairs divided by the distance of the
+#                    "horizontal" pair (eye/mouth aspect ratio, independent of the face size)
+# An optional "release" threshold adds hysteresis: an active signal stays active until it crosses it.
+# A gesture binds a signal to an action. Empty signals/table in the config mean the classic
+# gestures built from the eye and mouth settings above.
+ASPECT_RATIO_GESTURE_SIGNALS = {
+    "right_eye_closed": {"type": "aspect_ratio", "vertical": [[385, 380], [387, 373]], "horizontal": [362, 263],
+                         "compare": "less", "threshold": EYE_CLOSED_RATIO, "release": EYE_OPEN_RATIO},
+    "left_eye_closed": {"type": "aspect_ratio", "vertical": [[160, 144], [158, 153]], "horizontal": [33, 133],
+                        "compare": "less", "threshold": EYE_CLOSED_RATIO, "release": EYE_OPEN_RATIO},
+    "mouth_open": {"type": "aspect_ratio", "vertical": [[81, 178], [13, 14], [311, 402]], "horizontal": [61, 291],
+                   "compare": "greater", "threshold": MOUTH_OPEN_RATIO, "release": MOUTH_CLOSED_RATIO}
+}
+GAP_GESTURE_SIGNALS = {
+    "right_eye_closed": {"type": "gap", "from": 386, "to": 374, "axis": "y", "compare": "less",
+                         "threshold": EYE_CLOSE_THRESHOLD},
+    "left_eye_closed": {"type": "gap", "from": 159, "to": 145, "axis": "y", "compare": "less",
+                        "threshold": EYE_CLOSE_THRESHOLD},
+    "mouth_open": {"type": "gap", "from": 13, "to": 14, "axis": "y", "compare": "greater",
+                   "threshold": MOUTH_OPEN_THRESHOLD}
+}
+DEFAULT_GESTURE_SIGNALS = ASPECT_RATIO_GESTURE_SIGNALS if OPENNESS_METRIC == "aspect_ratio" else GAP_GESTURE_SIGNALS
+GESTURE_SIGNALS = config["gestures"]["signals"] or DEFAULT_GESTURE_SIGNALS
+GESTURE_TABLE = config["gestures"]["table"] or [
+    {"name": "left_eye_hold", "signal": "left_eye_closed", "trigger": "hold",
+     "hold_time": LEFT_EYE_CLOSE_TIME_THRESHOLD, "cooldown": EYE_SWITCH_COOLDOWN_DURATION,
+     "action": "toggle_mouse_control", "mode": "any"},
+    {"name": "right_eye_hold", "signal": "right_eye_closed", "trigger": "hold",
+     "hold_time": RIGHT_EYE_RIGHT_CLICK_TIME_THRESHOLD, "cooldown": RIGHT_EYE_RIGHT_CLICK_COOLDOWN_DURATION,
+     "action": "right_click", "mode": "any"},
+    {"name": "mouth_open_menu", "signal": "mouth_open", "trigger": "edge",
+     "cooldown": MOUTH_MENU_SELECTION_COOLDOWN_DURATION, "action": "menu_select", "mode": "menu"},
+    {"name": "mouth_open_click", "signal": "mouth_open", "trigger": "edge",
+     "cooldown": MOUTH_CLICK_COOLDOWN_DURATION, "action": "click", "mode": "mouse"},
+    {"name": "mouth_open_hold", "signal": "mouth_open", "trigger": "hold",
+     "hold_time": MOUTH_OPEN_RIGHT_CLICK_TIME_THRESHOLD, "cooldown": MOUTH_RIGHT_CLICK_COOLDOWN_DURATION,
+     "action": "right_click", "mode": "mouse"}
+]
 
 # ============ FILTERING AND JITTER REDUCTION SETTINGS ============
 FILTER_METHOD = config["filtering"]["filter_method"]
@@ -122,44 +289,113 @@ MOVE_THRESHOLD_PIXELS = config["filtering"]["move_threshold_pixels"]
 USE_MOVEMENT_THRESHOLD = config["filtering"]["use_movement_threshold"]
 USE_MEDIAN_FILTER = config["filtering"]["use_median_filter"]
 MEDIAN_FILTER_WINDOW = config["filtering"]["median_filter_window"]
+ONE_EURO_MIN_CUTOFF = config["filtering"]["one_euro_min_cutoff"]
+ONE_EURO_BETA = config["filtering"]["one_euro_beta"]
+ONE_EURO_D_CUTOFF = config["filtering"]["one_euro_d_cutoff"]
+KALMAN_PROCESS_NOISE = config["filtering"]["kalman_process_noise"]
+KALMAN_MEASUREMENT_NOISE = config["filtering"]["kalman_measurement_noise"]
+
+# ============ FACE TRACKING SETTINGS ============
+USE_ROI_TRACKING = config["tracking"]["use_roi_tracking"]
+ROI_PADDING = config["tracking"]["roi_padding"]
+ROI_MIN_SIZE = config["tracking"]["roi_min_size"]
+
+# ============ CAMERA CAPTURE SETTINGS ============
+# 0 or "" means "keep the driver default"
+CAPTURE_BACKEND = config["capture"]["backend"]
+CAPTURE_WIDTH = config["capture"]["width"]
+CAPTURE_HEIGHT = config["capture"]["height"]
+CAPTURE_FPS = config["capture"]["fps"]
+CAPTURE_FOURCC = config["capture"]["fourcc"]
+CAPTURE_BUFFER_SIZE = config["capture"]["buffer_size"]
+
+# ============ LATENCY COMPENSATION SETTINGS ============
+USE_LATENCY_COMPENSATION = config["prediction"]["use_latency_compensation"]
+PREDICTION_EXTRA_HORIZON = config["prediction"]["extra_horizon"]
+PREDICTION_MAX_HORIZON = config["prediction"]["max_horizon"]
+PREDICTION_MAX_OFFSET_PIXELS = config["prediction"]["max_offset_pixels"]
+PREDICTION_VELOCITY_SMOOTHING = config["prediction"]["velocity_smoothing"]
+
+# ============ CURSOR OUTPUT SETTINGS ============
+USE_CURSOR_THREAD = config["cursor_output"]["use_cursor_thread"]
+CURSOR_OUTPUT_RATE_HZ = config["cursor_output"]["rate_hz"]
+INPUT_BACKEND = config["cursor_output"]["backend"]
+
+# ============ SCREEN SETTINGS ============
+SCREEN_AREA = config["screen"]["area"]  # "primary" - main monitor, "all" - all monitors (virtual desktop)
+SCREEN_EDGE_MARGIN = config["screen"]["edge_margin"]  # pixels
+SCREEN_REFRESH_INTERVAL = config["screen"]["refresh_interval"]  # seconds, 0 - read the layout only at start
+
+# ============ CURSOR MAPPING SETTINGS ============
+# "nose" - nose position in the frame, "head_pose" - head yaw/pitch angles estimated from the face mesh
+MAPPING_METHOD = config["mapping"]["method"]
+# values mapped to the left/right (top/bottom) screen edges, set by --calibrate-mapping
+MAPPING_NOSE_X_RANGE = config["mapping"]["nose_x_range"]  # [] - the classic nose box
+MAPPING_NOSE_Y_RANGE = config["mapping"]["nose_y_range"]
+MAPPING_YAW_RANGE = config["mapping"]["yaw_range"]  # degrees
+MAPPING_PITCH_RANGE = config["mapping"]["pitch_range"]
+
+# ============ POWER SAVING SETTINGS ============
+POWER_SAVING = config["power_saving"]["enabled"]
+IDLE_AFTER = config["power_saving"]["idle_after"]  # seconds without activity
+IDLE_FPS = config["power_saving"]["idle_fps"]  # face mesh runs per second while idle
+IDLE_WHEN_STILL = config["power_saving"]["idle_when_still"]  # a still head also counts as idle
+IDLE_MOTION_THRESHOLD = config["power_saving"]["motion_threshold_pixels"]  # movement of the mapped cursor
+IDLE_CAPTURE_FPS = config["power_saving"]["idle_capture_fps"]  # 0 - camera keeps its frame rate
+
+# ============ METRICS SETTINGS ============
+SHOW_METRICS_OVERLAY = config["metrics"]["show_overlay"]
+METRICS_UPDATE_INTERVAL = config["metrics"]["update_interval"]
+METRICS_HISTORY_SIZE = config["metrics"]["history_size"]
+METRICS_FRAME_BUDGET_MS = config["metrics"]["frame_budget_ms"]
+METRICS_ENDPOINT_PORT = config["metrics"]["endpoint_port"]  # 0 - no endpoint
+METRICS_FILE = config["metrics"]["file"]  # "" - no file
 
 # ============ PROGRAM WORKING VARIABLES ============
 prev_frame_time = 0
 new_frame_time = 0
-left_eye_closed_start_time = None
-right_eye_closed_start_time = None
-mouth_open_start_time = None
-eye_switch_cooldown = False
-eye_switch_cooldown_time = 0
-prev_left_eye_closed = False
-prev_right_eye_closed = False
-prev_mouth_open = False
-right_eye_right_click_cooldown = False
-right_eye_right_click_cooldown_time = 0
-mouth_right_click_cooldown = False
-mouth_right_click_cooldown_time = 0
-mouth_click_cooldown = False
-mouth_click_cooldown_time = 0
-mouth_menu_selection_cooldown = False
-mouth_menu_selection_cooldown_time = 0
-position_history_x = []
-position_history_y = []
 smoothed_x = None
 smoothed_y = None
 last_action = ""
 last_action_time = 0
 menu_socket = None
+roi_box = None
+captured_frames = 0
+processed_frames = 0
+recorder = None
+metrics_snapshot = {}
+stop_event = threading.Event()
 
 
 # ============ SOCKET COMMUNICATION ============
+# Commands to the AbleMouse Beyond Switch server are put into a bounded outbox and sent by the menu
+# client thread, one JSON object per line. The thread does not wait for an acknowledgement before
+# sending the next command; acknowledgements are read as they arrive and matched by id. A lost
+# connection is re-established with growing delays, so menu commands never stall the vision loop.
+# With the "udp" transport every batch of commands is one datagram and nothing is acknowledged.
+# A stream connection starts with a "hello" that tells the server our protocol version.
+MENU_PROTOCOL_VERSION = 2
+menu_outbox = queue.Queue(maxsize=MENU_OUTBOX_SIZE)
+menu_client_thread = None
+menu_client = {"next_id": 1, "pending": {}, "buffer": b"", "dropped": 0, "protocol": None}
+
+
 def connect_to_menu():
     """connect to server"""
     global menu_socket
     try:
-        menu_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        menu_socket.settimeout(2.0)
-        menu_socket.connect((MENU_HOST, MENU_PORT))
-        menu_socket.settimeout(5.0)
+        if MENU_TRANSPORT == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(2.0)
+            sock.connect(MENU_SOCKET_PATH)
+        elif MENU_TRANSPORT == "udp":
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.connect((MENU_HOST, MENU_PORT))
+        else:
+            sock = socket.create_connection((MENU_HOST, MENU_PORT), timeout=2.0)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(5.0)
+        menu_socket = sock
         print("Connected to AbleMouse Beyond Switch server")
         return True
     except Exception as e:
@@ -168,41 +404,103 @@ def connect_to_menu():
 
 
 def send_menu_command(command):
-    """send command to AbleMouse Beyond Switch server"""
-    global menu_socket
-
+    """Queues a command for AbleMouse Beyond Switch server. Returns False if the server is not connected"""
     if not menu_socket:
-        if not connect_to_menu():
-            return False
+        return False
 
+    message = {"id": menu_client["next_id"], "command": command}
+    menu_client["next_id"] += 1
     try:
-        data = json.dumps({"command": command}).encode('utf-8')
-        menu_socket.sendall(data)
-
+        menu_outbox.put_nowait(message)
+    except queue.Full:
+        # the oldest command is the least useful one, keep the newest
         try:
-            response = menu_socket.recv(1024)
-            if response:
-                response_data = json.loads(response.decode('utf-8'))
-                if response_data.get('status') == 'received':
-                    print(f"Command '{command}' is delivered to AbleMouse Beyond Switch server")
-                    return True
-        except socket.timeout:
-            print(f"Command '{command}' sent without confirmation")
-            return True
-        except:
-            print(f"Command '{command}'. Something happened")
-            return True
+            dropped = menu_outbox.get_nowait()
+            menu_client["dropped"] += 1
+            print(f"Menu outbox full, dropped command {dropped['command']} ({menu_client['dropped']} dropped so far)")
+        except queue.Empty:
+            pass
+        menu_outbox.put_nowait(message)
+    return True
 
-    except Exception as e:
-        print(f"Failed to sent to to AbleMouse Beyond Switch server: {e}")
+
+def send_queued_menu_commands():
+    """Sends everything in the outbox without waiting for acknowledgements"""
+    lines = []
+    while True:
         try:
-            menu_socket.close()
-        except:
-            pass
-        menu_socket = None
+            message = menu_outbox.get_nowait()
+        except queue.Empty:
+            break
+        if MENU_TRANSPORT != "udp":
+            menu_client["pending"][message["id"]] = (message["command"], time.perf_counter())
+        lines.append(json.dumps(message) + "\n")
+    if lines:
+        menu_socket.sendall("".join(lines).encode('utf-8'))
+
+
+def read_menu_acknowledgements():
+    """Reads acknowledgements from the server. Returns False if the server closed the connection"""
+    data = menu_socket.recv(4096)
+    if not data:
         return False
 
-    return False
+    menu_client["buffer"] += data
+    *lines, menu_client["buffer"] = menu_client["buffer"].split(b"\n")
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            response = json.loads(line.decode('utf-8'))
+        except ValueError:
+            print(f"Unexpected answer from AbleMouse Beyond Switch server: {line[:80]}")
+            continue
+        if response.get("status") == "hello":
+            menu_client["protocol"] = response.get("protocol")
+            print(f"AbleMouse Beyond Switch server speaks protocol version {menu_client['protocol']}")
+            continue
+        pending = menu_client["pending"].pop(response.get("id"), None)
+        if pending and response.get("status") == "received":
+            command, sent_time = pending
+            print(f"Command '{command}' is delivered to AbleMouse Beyond Switch server "
+                  f"({(time.perf_counter() - sent_time) * 1000:.1f} ms)")
+    return True
+
+
+def menu_client_loop():
+    """Keeps the connection to the menu server, sends queued commands and reads acknowledgements"""
+    delay = MENU_RECONNECT_MIN_DELAY
+    while not stop_event.is_set():
+        if not menu_socket and not connect_to_menu():
+            stop_event.wait(delay)
+            delay = min(delay * 2, MENU_RECONNECT_MAX_DELAY)
+            continue
+        delay = MENU_RECONNECT_MIN_DELAY
+
+        try:
+            if MENU_TRANSPORT != "udp":
+                hello = {"command": "hello", "protocol": MENU_PROTOCOL_VERSION, "client": "AbleMouse AI edition"}
+                menu_socket.sendall((json.dumps(hello) + "\n").encode('utf-8'))
+            while not stop_event.is_set():
+                send_queued_menu_commands()
+                # short wait: a new command is picked up within 10 ms, acknowledgements as soon as they arrive
+                readable, _, _ = select.select([menu_socket], [], [], 0.01)
+                if readable and not read_menu_acknowledgements():
+                    print("AbleMouse Beyond Switch server closed the connection")
+                    break
+        except Exception as e:
+            print(f"Connection to AbleMouse Beyond Switch server lost: {e}")
+
+        if menu_client["pending"]:
+            print(f"{len(menu_client['pending'])} command(s) sent without confirmation")
+        disconnect_from_menu()
+
+
+def start_menu_client():
+    """Starts the menu client thread"""
+    global menu_client_thread
+    menu_client_thread = threading.Thread(target=menu_client_loop, daemon=True)
+    menu_client_thread.start()
 
 
 def disconnect_from_menu():
@@ -210,27 +508,49 @@ def disconnect_from_menu():
     if menu_socket:
         try:
             menu_socket.close()
-            menu_socket = None
             print("disconnected from AbleMouse Beyond Switch server")
         except:
             pass
+        menu_socket = None
+    menu_client["pending"].clear()
+    menu_client["buffer"] = b""
+    menu_client["protocol"] = None
 
 
 # ============ FILTERING FUNCTIONS ============
+def create_median_history():
+    """Creates state of a sliding-window median: values in arrival order and the same values kept sorted"""
+    return {"window": deque(), "sorted": []}
+
+
+def update_rolling_median(history, value, window_size):
+    """Adds value to the window and returns the window median (None until the window is full).
+    Sorted values are updated incrementally: binary search plus one insert/delete per frame
+    instead of sorting the whole window, so long windows (30-60 frames) cost almost nothing"""
+    window = history["window"]
+    sorted_values = history["sorted"]
+
+    window.append(value)
+    bisect.insort(sorted_values, value)
+
+    if len(window) > window_size:
+        oldest = window.popleft()
+        del sorted_values[bisect.bisect_left(sorted_values, oldest)]
+
+    if len(window) == window_size:
+        return sorted_values[window_size // 2]
+    return None
+
+
 def apply_median_filter(x, y, history_x, history_y, window_size):
     """Applies median filter to current coordinates"""
-    history_x.append(x)
-    history_y.append(y)
-
-    if len(history_x) > window_size:
-        history_x.pop(0)
-        history_y.pop(0)
-
-    if len(history_x) == window_size:
-        sorted_x = sorted(history_x.copy())
-        sorted_y = sorted(history_y.copy())
-        median_x = sorted_x[window_size // 2]
-        median_y = sorted_y[window_size // 2]
+    if window_size <= 1:
+        return x, y
+
+    median_x = update_rolling_median(history_x, x, window_size)
+    median_y = update_rolling_median(history_y, y, window_size)
+
+    if median_x is not None:
         return median_x, median_y
 
     return x, y
@@ -246,6 +566,112 @@ def apply_exponential_smoothing(current_x, current_y, smoothed_x, smoothed_y, al
     return new_x, new_y
 
 
+def create_one_euro_state():
+    """Creates state of a One Euro filter for one axis"""
+    return {"value": None, "speed": 0.0, "timestamp": None}
+
+
+def one_euro_alpha(elapsed, cutoff):
+    """Smoothing factor of a low-pass filter with the given cutoff frequency (Hz)"""
+    r = 2 * math.pi * cutoff * elapsed
+    return r / (r + 1)
+
+
+def apply_one_euro_filter(state, value, timestamp, min_cutoff, beta, d_cutoff):
+    """One Euro filter (Casiez et al.): exponential smoothing whose cutoff frequency grows with speed.
+    Slow precise movements are smoothed strongly, fast head sweeps get almost no lag"""
+    if state["value"] is None:
+        state["value"] = value
+        state["timestamp"] = timestamp
+        return value
+
+    elapsed = timestamp - state["timestamp"]
+    if elapsed <= 0:
+        return state["value"]
+
+    speed = (value - state["value"]) / elapsed
+    speed_alpha = one_euro_alpha(elapsed, d_cutoff)
+    speed = speed_alpha * speed + (1 - speed_alpha) * state["speed"]
+
+    cutoff = min_cutoff + beta * abs(speed)
+    alpha = one_euro_alpha(elapsed, cutoff)
+    filtered = alpha * value + (1 - alpha) * state["value"]
+
+    state["value"] = filtered
+    state["speed"] = speed
+    state["timestamp"] = timestamp
+    return filtered
+
+
+def create_kalman_state():
+    """Creates state of a constant-velocity Kalman filter for one axis: position, velocity, covariance"""
+    return {"position": None, "velocity": 0.0, "p00": 0.0, "p01": 0.0, "p11": 0.0, "timestamp": None}
+
+
+def apply_kalman_filter(state, value, timestamp, process_noise, measurement_noise):
+    """Constant-velocity Kalman filter. process_noise is acceleration variance (px^2/s^4),
+    measurement_noise is variance of the measured position (px^2).
+    The 2x2 matrices are written out by hand - numpy is slower than plain floats for this size"""
+    if state["position"] is None:
+        state["position"] = value
+        state["velocity"] = 0.0
+        state["p00"] = measurement_noise
+        state["p01"] = 0.0
+        state["p11"] = measurement_noise * 100
+        state["timestamp"] = timestamp
+        return value
+
+    dt = timestamp - state["timestamp"]
+    if dt <= 0:
+        return state["position"]
+
+    # Predict
+    position = state["position"] + state["velocity"] * dt
+    velocity = state["velocity"]
+    p00 = state["p00"] + dt * (2 * state["p01"] + dt * state["p11"]) + process_noise * dt ** 4 / 4
+    p01 = state["p01"] + dt * state["p11"] + process_noise * dt ** 3 / 2
+    p11 = state["p11"] + process_noise * dt ** 2
+
+    # Update with measured position
+    innovation = value - position
+    s = p00 + measurement_noise
+    k0 = p00 / s
+    k1 = p01 / s
+    position += k0 * innovation
+    velocity += k1 * innovation
+
+    state["position"] = position
+    state["velocity"] = velocity
+    state["p00"] = (1 - k0) * p00
+    state["p01"] = (1 - k0) * p01
+    state["p11"] = p11 - k1 * p01
+    state["timestamp"] = timestamp
+    return position
+
+
+def create_prediction_state():
+    """Creates state of the latency compensation stage for one axis"""
+    return {"position": None, "timestamp": None, "velocity": 0.0}
+
+
+def apply_latency_compensation(state, value, frame_time, now):
+    """Extrapolates filtered position from the moment the frame was captured to now.
+    Velocity is estimated from consecutive filtered positions and their capture timestamps.
+    The horizon (measured processing latency + extra_horizon for camera exposure/transfer)
+    and the resulting offset are clamped, so a wrong estimate cannot throw the cursor away"""
+    if state["position"] is not None and frame_time > state["timestamp"]:
+        speed = (value - state["position"]) / (frame_time - state["timestamp"])
+        state["velocity"] = (PREDICTION_VELOCITY_SMOOTHING * speed +
+                             (1 - PREDICTION_VELOCITY_SMOOTHING) * state["velocity"])
+    state["position"] = value
+    state["timestamp"] = frame_time
+
+    horizon = min(now - frame_time + PREDICTION_EXTRA_HORIZON, PREDICTION_MAX_HORIZON)
+    offset = state["velocity"] * horizon
+    offset = max(-PREDICTION_MAX_OFFSET_PIXELS, min(PREDICTION_MAX_OFFSET_PIXELS, offset))
+    return value + offset
+
+
 def should_update_cursor(current_x, current_y, prev_x, prev_y, threshold):
     """Checks if movement is sufficient to update cursor"""
     if not USE_MOVEMENT_THRESHOLD:
@@ -262,48 +688,1167 @@ def set_last_action(action):
     last_action_time = time.time()
 
 
-# ============ MAIN PROGRAM ============
-if USE_MENU_SYSTEM:
-    if not connect_to_menu():
-        print("Run without integration with AbleMouse Beyond Switch server")
-        USE_MENU_SYSTEM = False
+# ============ CAMERA SETUP ============
+CAPTURE_BACKENDS = {
+    "auto": cv2.CAP_ANY,
+    "dshow": cv2.CAP_DSHOW,
+    "msmf": cv2.CAP_MSMF,
+    "v4l2": cv2.CAP_V4L2,
+    "avfoundation": cv2.CAP_AVFOUNDATION
+}
+
+
+def fourcc_to_str(fourcc):
+    """Converts numeric FOURCC reported by OpenCV to text, e.g. 1196444237 -> 'MJPG'"""
+    fourcc = int(fourcc)
+    return "".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4))
+
+
+def open_camera():
+    """Opens the camera with the configured backend and negotiates capture parameters"""
+    backend = CAPTURE_BACKENDS.get(CAPTURE_BACKEND)
+    if backend is None:
+        print(f"Unknown capture backend '{CAPTURE_BACKEND}'. Using auto")
+        backend = cv2.CAP_ANY
+
+    cap = cv2.VideoCapture(camera, backend)
+    if not cap.isOpened():
+        return cap
+
+    # FOURCC goes first: many drivers offer high resolutions/FPS only for compressed formats (MJPG)
+    if CAPTURE_FOURCC:
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*CAPTURE_FOURCC[:4].ljust(4)))
+    if CAPTURE_WIDTH:
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_WIDTH)
+    if CAPTURE_HEIGHT:
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_HEIGHT)
+    if CAPTURE_FPS:
+        cap.set(cv2.CAP_PROP_FPS, CAPTURE_FPS)
+    if CAPTURE_BUFFER_SIZE:
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, CAPTURE_BUFFER_SIZE)
+
+    report_camera_settings(cap)
+    return cap
+
+
+def report_camera_settings(cap):
+    """Prints what the camera driver actually granted (it may silently ignore requested values)"""
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    fourcc = fourcc_to_str(cap.get(cv2.CAP_PROP_FOURCC))
+    buffer_size = int(cap.get(cv2.CAP_PROP_BUFFERSIZE))
+
+    print(f"Camera {camera} opened with backend {cap.getBackendName()}")
+    print(f"  resolution : {width}x{height}" + (f" (requested {CAPTURE_WIDTH}x{CAPTURE_HEIGHT})"
+                                                   if CAPTURE_WIDTH or CAPTURE_HEIGHT else ""))
+    print(f"  fps        : {fps:.1f}" + (f" (requested {CAPTURE_FPS})" if CAPTURE_FPS else ""))
+    print(f"  fourcc     : {fourcc.strip() or 'unknown'}" + (f" (requested {CAPTURE_FOURCC})"
+                                                             if CAPTURE_FOURCC else ""))
+    # 0 means the backend does not report buffer size
+    print(f"  buffer     : {buffer_size or 'unknown'}" + (f" (requested {CAPTURE_BUFFER_SIZE})"
+                                                          if CAPTURE_BUFFER_SIZE else ""))
+
+
+# ============ FACE LANDMARKS ============
+# The landmarks the program uses are copied once per frame into preallocated NumPy arrays.
+# Gestures, cursor mapping, ROI tracking and the overlay all read these arrays by row.
+BASE_LANDMARKS = (386, 374, 145, 159, 13, 14, 94, 10, 152, 234, 454)
+
+
+def signal_landmark_pairs(signal):
+    """Returns (measured landmark pairs, horizontal pair or None) of a gesture signal"""
+    if signal.get("type", "gap") == "aspect_ratio":
+        return [tuple(pair) for pair in signal["vertical"]], tuple(signal["horizontal"])
+    return [(signal["from"], signal["to"])], None
+
+
+def signal_landmarks(signal):
+    pairs, horizontal = signal_landmark_pairs(signal)
+    return {landmark for pair in pairs + [horizontal or ()] for landmark in pair}
+
+
+# nose tip, chin, outer eye corners, mouth corners - points of the 3D head model (see CURSOR MAPPING)
+HEAD_POSE_LANDMARKS = (1, 152, 33, 263, 61, 291)
+
+# landmarks of configured gesture signals (and of the head model) are appended after the base ones
+USED_LANDMARKS = BASE_LANDMARKS + tuple(sorted(
+    set().union(*(signal_landmarks(signal) for signal in GESTURE_SIGNALS.values()),
+                # --calibrate measures aspect ratios even while the default signals use "gap"
+                *(signal_landmarks(signal) for signal in ASPECT_RATIO_GESTURE_SIGNALS.values()
+                  if GESTURE_SIGNALS is DEFAULT_GESTURE_SIGNALS),
+                HEAD_POSE_LANDMARKS if MAPPING_METHOD == "head_pose" else ()) - set(BASE_LANDMARKS)))
+RIGHT_EYE_TOP, RIGHT_EYE_BOTTOM = 0, 1
+LEFT_EYE_BOTTOM, LEFT_EYE_TOP = 2, 3
+LIP_UPPER, LIP_LOWER = 4, 5
+NOSE = 6
+# Forehead, chin and both cheeks - enough to bound the face without walking all 478 landmarks
+FACE_BOUNDARY = slice(7, 11)
+
+face_points = np.zeros((len(USED_LANDMARKS), 3))  # normalised x, y, z
+face_points_px = np.zeros((len(USED_LANDMARKS), 2), dtype=np.int32)  # pixel x, y
+face_points_scaled = np.zeros((len(USED_LANDMARKS), 2))
+frame_size = np.zeros(2)
+
+
+USED_LANDMARK_ROWS = tuple(zip(face_points, USED_LANDMARKS))  # (row view of face_points, landmark index)
+
+
+def extract_landmarks(landmarks):
+    """Copies the used landmarks of a face mesh result into face_points, row by row without temporary lists"""
+    for point, i in USED_LANDMARK_ROWS:
+        landmark = landmarks[i]
+        point[0] = landmark.x
+        point[1] = landmark.y
+        point[2] = landmark.z
+
+
+def update_pixel_coordinates(frame_w, frame_h):
+    """Fills face_points_px from face_points without allocating new arrays"""
+    frame_size[0] = frame_w
+    frame_size[1] = frame_h
+    np.multiply(face_points[:, :2], frame_size, out=face_points_scaled)
+    np.copyto(face_points_px, face_points_scaled, casting='unsafe')
+
+
+# ============ REGION OF INTEREST TRACKING ============
+def compute_roi_box(frame_w, frame_h):
+    """Returns padded face box (x0, y0, x1, y1) in pixels around the face in face_points"""
+    xs = face_points[FACE_BOUNDARY, 0] * frame_w
+    ys = face_points[FACE_BOUNDARY, 1] * frame_h
+    center_x = (xs.min() + xs.max()) / 2
+    center_y = (ys.min() + ys.max()) / 2
+    size = max(xs.max() - xs.min(), ys.max() - ys.min()) * (1 + 2 * ROI_PADDING)
+    size = max(size, ROI_MIN_SIZE)
+
+    x0 = max(0, int(center_x - size / 2))
+    y0 = max(0, int(center_y - size / 2))
+    x1 = min(frame_w, int(center_x + size / 2))
+    y1 = min(frame_h, int(center_y + size / 2))
+    if x1 - x0 < ROI_MIN_SIZE // 2 or y1 - y0 < ROI_MIN_SIZE // 2:
+        return None
+    return x0, y0, x1, y1
+
+
+def remap_points_from_roi(box, frame_w, frame_h):
+    """Converts face_points normalised to the ROI crop back to full frame normalised coordinates"""
+    x0, y0, x1, y1 = box
+    face_points[:, 0] *= (x1 - x0) / frame_w
+    face_points[:, 0] += x0 / frame_w
+    face_points[:, 1] *= (y1 - y0) / frame_h
+    face_points[:, 1] += y0 / frame_h
+    face_points[:, 2] *= (x1 - x0) / frame_w
+
+
+def detect_face_landmarks(frame):
+    """Runs face mesh on the whole frame or, in ROI tracking mode, on a crop around the previous face.
+    Falls back to full-frame detection when the face is lost in the crop.
+    Returns True and fills face_points / face_points_px if a face was found"""
+    global roi_box
+    frame_h, frame_w, _ = frame.shape
+
+    face_found = False
+    convert_time = 0.0
+    face_mesh_time = 0.0
+    if USE_ROI_TRACKING and roi_box is not None:
+        box = roi_box
+        x0, y0, x1, y1 = box
+        stage_start = time.perf_counter()
+        rgb_crop = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+        convert_time += time.perf_counter() - stage_start
+        stage_start = time.perf_counter()
+        landmark_points = face_mesh.process(rgb_crop).multi_face_landmarks
+        face_mesh_time += time.perf_counter() - stage_start
+        if landmark_points:
+            extract_landmarks(landmark_points[0].landmark)
+            remap_points_from_roi(box, frame_w, frame_h)
+            face_found = True
+        else:
+            roi_box = None
+
+    if not face_found:
+        stage_start = time.perf_counter()
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        convert_time += time.perf_counter() - stage_start
+        stage_start = time.perf_counter()
+        landmark_points = face_mesh.process(rgb_frame).multi_face_landmarks
+        face_mesh_time += time.perf_counter() - stage_start
+        face_found = bool(landmark_points)
+        if face_found:
+            extract_landmarks(landmark_points[0].landmark)
+
+    record_stage_time("convert", convert_time)
+    record_stage_time("face_mesh", face_mesh_time)
+    if not face_found:
+        return False
+
+    if USE_ROI_TRACKING:
+        roi_box = compute_roi_box(frame_w, frame_h)
+    update_pixel_coordinates(frame_w, frame_h)
+    return True
+
+
+# ============ GESTURE ENGINE ============
+# All signals and gestures are evaluated in one NumPy pass per frame. Only the gestures that
+# fire run Python code (their action). Trigger types:
+#   "edge" - fires when the signal becomes active (e.g. the mouth opens)
+#   "hold" - fires when the signal stays active for hold_time seconds (e.g. a closed eye)
+# Actions must not block the vision loop: clicks go to the action executor.
+# After firing a gesture waits cooldown seconds. An edge gesture whose action was not performed
+# (e.g. mouse control is off) does not start the cooldown.
+GESTURE_PROGRESS_COLORS = [(0, 255, 0), (255, 0, 0), (255, 255, 0), (0, 255, 255), (255, 0, 255)]
+GESTURE_SIGNAL_COLORS = [(0, 255, 0), (255, 0, 0), (0, 0, 255), (0, 255, 255), (255, 0, 255)]
+
+
+def create_gesture_engine(signals, table):
+    """Converts the signal and gesture tables from the config into NumPy arrays.
+    Gestures with an unknown signal, trigger or action are skipped with a message"""
+    signal_names = list(signals)
+    gestures = []
+    for gesture in table:
+        if gesture["signal"] not in signals:
+            print(f"Gesture '{gesture['name']}': unknown signal '{gesture['signal']}'. Skipped")
+        elif gesture["trigger"] not in ("edge", "hold"):
+            print(f"Gesture '{gesture['name']}': unknown trigger '{gesture['trigger']}'. Skipped")
+        elif gesture["action"] not in GESTURE_ACTIONS:
+            print(f"Gesture '{gesture['name']}': unknown action '{gesture['action']}'. Skipped")
+        else:
+            gestures.append(gesture)
+
+    signal_rows = [signals[name] for name in signal_names]
+    # every signal is the mean of its landmark pairs, divided by its horizontal pair (1 if it has none)
+    pair_from, pair_to, pair_signal, pair_axis, pair_is_distance = [], [], [], [], []
+    horizontal_from, horizontal_to = [], []
+    for i, signal in enumerate(signal_rows):
+        pairs, horizontal = signal_landmark_pairs(signal)
+        for landmark_from, landmark_to in pairs:
+            pair_from.append(USED_LANDMARKS.index(landmark_from))
+            pair_to.append(USED_LANDMARKS.index(landmark_to))
+            pair_signal.append(i)
+            pair_axis.append(0 if signal.get("axis", "y") == "x" else 1)
+            pair_is_distance.append(horizontal is not None)
+        horizontal = horizontal or (pairs[0][0], pairs[0][0])
+        horizontal_from.append(USED_LANDMARKS.index(horizontal[0]))
+        horizontal_to.append(USED_LANDMARKS.index(horizontal[1]))
+
+    is_hold = np.array([gesture["trigger"] == "hold" for gesture in gestures], dtype=bool)
+    modes = [gesture.get("mode", "any") for gesture in gestures]
+    return {
+        "signal_names": signal_names,
+        "pair_from": np.array(pair_from, dtype=np.intp),
+        "pair_to": np.array(pair_to, dtype=np.intp),
+        "pair_signal": np.array(pair_signal, dtype=np.intp),
+        "pair_axis": np.array(pair_axis, dtype=np.intp),
+        "pair_is_distance": np.array(pair_is_distance, dtype=bool),
+        "pair_count": np.bincount(pair_signal, minlength=len(signal_rows)),
+        "horizontal_from": np.array(horizontal_from, dtype=np.intp),
+        "horizontal_to": np.array(horizontal_to, dtype=np.intp),
+        "is_ratio": np.array([signal.get("type", "gap") == "aspect_ratio" for signal in signal_rows], dtype=bool),
+        "signal_greater": np.array([signal["compare"] == "greater" for signal in signal_rows], dtype=bool),
+        "signal_threshold": np.array([signal["threshold"] for signal in signal_rows], dtype=float),
+        "signal_release": np.array([signal.get("release", signal["threshold"]) for signal in signal_rows],
+                                   dtype=float),
+        "prev_signal_state": np.zeros(len(signal_rows), dtype=bool),
+        "gestures": gestures,
+        "gesture_signal": np.array([signal_names.index(gesture["signal"]) for gesture in gestures], dtype=np.intp),
+        "is_hold": is_hold,
+        "hold_time": np.array([gesture.get("hold_time", 0.0) for gesture in gestures], dtype=float),
+        "cooldown": np.array([gesture.get("cooldown", 0.0) for gesture in gestures], dtype=float),
+        "for_mouse": np.array([mode in ("any", "mouse") for mode in modes], dtype=bool),
+        "for_menu": np.array([mode in ("any", "menu") for mode in modes], dtype=bool),
+        "progress_row": np.cumsum(is_hold) - 1,  # row of the progress bar of every hold gesture
+        "start_time": np.full(len(gestures), np.nan),
+        "cooldown_until": np.full(len(gestures), -np.inf)
+    }
+
+
+def compute_signal_values(engine, points, points_scaled):
+    """Measures all signals. points - normalised landmarks (gaps), points_scaled - pixel landmarks (ratios),
+    so aspect ratios are not distorted by a non-square frame"""
+    pair_from, pair_to = engine["pair_from"], engine["pair_to"]
+    gaps = points[pair_to, engine["pair_axis"]] - points[pair_from, engine["pair_axis"]]
+    distances = np.hypot(*(points_scaled[pair_to] - points_scaled[pair_from]).T)
+    measures = np.where(engine["pair_is_distance"], distances, gaps)
+    values = np.bincount(engine["pair_signal"], weights=measures, minlength=len(engine["pair_count"]))
+    values /= engine["pair_count"]
+
+    widths = np.hypot(*(points_scaled[engine["horizontal_to"]] - points_scaled[engine["horizontal_from"]]).T)
+    return np.where(engine["is_ratio"], values / np.maximum(widths, 1e-6), values)
+
+
+def evaluate_gestures(engine, points, points_scaled, now, menu_mode):
+    """One vectorised pass over all signals and gestures for the landmarks in points.
+    Returns (indices of the gestures that fire, hold progress 0..1 of every gesture - nan if not holding)"""
+    values = compute_signal_values(engine, points, points_scaled)
+    greater = engine["signal_greater"]
+    becomes_active = np.where(greater, values > engine["signal_threshold"], values < engine["signal_threshold"])
+    stays_active = np.where(greater, values >= engine["signal_release"], values <= engine["signal_release"])
+    signal_state = np.where(engine["prev_signal_state"], stays_active, becomes_active)
+    signal_rising = signal_state & ~engine["prev_signal_state"]
+    engine["prev_signal_state"] = signal_state
+
+    active = signal_state[engine["gesture_signal"]]
+    rising = signal_rising[engine["gesture_signal"]]
+    ready = (now > engine["cooldown_until"]) & (engine["for_menu"] if menu_mode else engine["for_mouse"])
+
+    start_time = engine["start_time"]
+    start_time[rising & ready] = now
+    start_time[~active] = np.nan
+    elapsed = now - start_time  # nan while the gesture is not being held
+
+    is_hold = engine["is_hold"]
+    fired = ready & np.where(is_hold, elapsed >= engine["hold_time"], rising)
+    progress = np.where(is_hold & ready, elapsed / np.maximum(engine["hold_time"], 1e-6), np.nan)
+    start_time[fired] = np.nan
+    return np.flatnonzero(fired), progress
+
+
+def finish_gesture(engine, index, performed, now):
+    """Starts the cooldown of a fired gesture"""
+    if performed or engine["is_hold"][index]:
+        engine["cooldown_until"][index] = now + engine["cooldown"][index]
+
+
+def draw_gesture_overlay(frame, engine, progress):
+    """Draws the signal landmarks and a progress bar for every gesture that is being held"""
+    for pair_from, pair_to, i in zip(engine["pair_from"], engine["pair_to"], engine["pair_signal"]):
+        color = GESTURE_SIGNAL_COLORS[i % len(GESTURE_SIGNAL_COLORS)]
+        cv2.circle(frame, face_points_px[pair_from], 3, color)
+        cv2.circle(frame, face_points_px[pair_to], 3, color)
+
+    for index in np.flatnonzero(~np.isnan(progress)):
+        row = engine["progress_row"][index]
+        color = GESTURE_PROGRESS_COLORS[row % len(GESTURE_PROGRESS_COLORS)]
+        y = 50 + 70 * row
+        progress_width = int(progress[index] * 200)
+        label = engine["gestures"][index]["action"].replace("_", " ").upper()
+        cv2.rectangle(frame, (10, y), (10 + progress_width, y + 20), color, -1)
+        cv2.rectangle(frame, (10, y), (210, y + 20), (255, 255, 255), 1)
+        cv2.putText(frame, f"{label} PROGRESS ...", (220, y + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+
+
+def gesture_title(gesture):
+    return gesture["name"].replace("_", " ")
+
+
+def toggle_mouse_control_action(frame, gesture):
+    global bln_cam_mouse_control
+    bln_cam_mouse_control = not bln_cam_mouse_control
+    status = "ENABLED" if bln_cam_mouse_control else "DISABLED"
+    set_last_action(f"Mouse control {status}")
+    if not HEADLESS:
+        frame_w = frame.shape[1]
+        cv2.putText(frame, f"Mouse control {status}!", (frame_w // 2 - 100, 50),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0) if bln_cam_mouse_control else (0, 0, 255), 2)
+    print(f"Mouse control {status}")
+    return True
+
+
+def click_action(frame, gesture):
+    if not bln_cam_mouse_control:
+        return False
+    submit_action(mouse_click)
+    set_last_action("Left click")
+    print(f"Click performed ({gesture_title(gesture)})")
+    return True
+
+
+def right_click_action(frame, gesture):
+    if not bln_cam_mouse_control:
+        return False
+    submit_action(mouse_right_click)
+    set_last_action(f"Right click ({gesture_title(gesture)})")
+    print(f"Right click performed ({gesture_title(gesture)})")
+    return True
+
+
+def menu_select_action(frame, gesture):
+    if not send_menu_command("select_current_item"):
+        print("Could not send command to AbleMouse Beyond Switch server")
+        return False
+    set_last_action(f"Menu selection ({gesture_title(gesture)})")
+    if not HEADLESS:
+        frame_w = frame.shape[1]
+        cv2.putText(frame, "Menu selection sent!", (frame_w // 2 - 100, 200),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+    return True
+
+
+def menu_navigation_action(command, title):
+    """Returns a gesture action that sends a navigation command to AbleMouse Beyond Switch server"""
+    def action(frame, gesture):
+        if not send_menu_command(command):
+            print("Could not send command to AbleMouse Beyond Switch server")
+            return False
+        set_last_action(f"{title} ({gesture_title(gesture)})")
+        return True
+    return action
+
+
+# action name in the gesture table -> function(frame, gesture), returns True if the action was performed
+GESTURE_ACTIONS = {
+    "toggle_mouse_control": toggle_mouse_control_action,
+    "click": click_action,
+    "right_click": right_click_action,
+    "menu_select": menu_select_action,
+    "menu_next": menu_navigation_action("next_item", "Menu next item"),
+    "menu_previous": menu_navigation_action("previous_item", "Menu previous item"),
+    "menu_back": menu_navigation_action("go_back", "Menu back"),
+    "menu_home": menu_navigation_action("go_home", "Menu home")
+}
+
+gesture_engine = create_gesture_engine(GESTURE_SIGNALS, GESTURE_TABLE)
+
+
+# ============ CALIBRATION ============
+# The user follows a few prompts while a measure of the face is recorded for every prompt:
+#   --calibrate          - openness of the eyes and the mouth, thresholds are placed between
+#                          the open and the closed values
+#   --calibrate-mapping  - nose position or head angles while looking at the screen edges
+# The result is saved to the config file.
+CALIBRATION_SETTLE_TIME = 2.0  # seconds to follow a prompt, these samples are not used
+CALIBRATION_PHASE_TIME = 3.0
+OPENNESS_CALIBRATION_PHASES = [
+    ("neutral", "Look at the screen: eyes open, mouth closed"),
+    ("right_eye", "Close your RIGHT eye"),
+    ("left_eye", "Close your LEFT eye"),
+    ("mouth", "Open your mouth")
+]
+calibration = {"phase": None, "prompt": "", "samples": {}, "measure": None}
+# calibration always measures aspect ratios, whatever openness_metric is in use now
+openness_engine = create_gesture_engine(ASPECT_RATIO_GESTURE_SIGNALS, []) \
+    if GESTURE_SIGNALS is DEFAULT_GESTURE_SIGNALS else None
+
+
+def collect_calibration_sample(phase):
+    """phase is read once by the caller, the calibration thread may end it at any moment"""
+    samples = calibration["samples"][phase]
+    value = calibration["measure"]()
+    if value is not None:
+        samples.append(value)
+
+
+def measure_openness():
+    return compute_signal_values(openness_engine, face_points, face_points_scaled)
+
+
+def split_threshold(active, inactive, greater):
+    """Places the threshold and the release value between the active and the inactive values
+    (at 40% and 60% of the gap). Returns None if the two distributions overlap"""
+    if greater:
+        low, high = np.percentile(inactive, 90), np.percentile(active, 10)
+    else:
+        low, high = np.percentile(active, 90), np.percentile(inactive, 10)
+    if high <= low:
+        return None
+    near_active, near_inactive = (low + 0.6 * (high - low), low + 0.4 * (high - low)) if greater else \
+        (low + 0.4 * (high - low), low + 0.6 * (high - low))
+    return float(near_active), float(near_inactive)
+
+
+def compute_calibrated_thresholds(samples):
+    """Returns new eye_and_mouth values from the calibration samples, None if calibration failed"""
+    names = openness_engine["signal_names"]
+    values = {phase: np.array(phase_samples) for phase, phase_samples in samples.items()}
+    if any(len(phase_values) == 0 for phase_values in values.values()):
+        print("Calibration failed: the face was not visible in every step")
+        return None
+
+    right, left, mouth = names.index("right_eye_closed"), names.index("left_eye_closed"), names.index("mouth_open")
+    eyes_closed = np.concatenate([values["right_eye"][:, right], values["left_eye"][:, left]])
+    eyes_open = np.concatenate([values["neutral"][:, right], values["neutral"][:, left]])
+    eye = split_threshold(eyes_closed, eyes_open, greater=False)
+    mouth_thresholds = split_threshold(values["mouth"][:, mouth], values["neutral"][:, mouth], greater=True)
+    if eye is None or mouth_thresholds is None:
+        print("Calibration failed: open and closed values overlap. Please try again")
+        return None
+
+    return {
+        "openness_metric": "aspect_ratio",
+        "eye_closed_ratio": round(eye[0], 4),
+        "eye_open_ratio": round(eye[1], 4),
+        "mouth_open_ratio": round(mouth_thresholds[0], 4),
+        "mouth_closed_ratio": round(mouth_thresholds[1], 4)
+    }
+
+
+def save_calibration(section, values):
+    """Writes the calibrated values into a section of the config file"""
+    config_path = get_config_path()
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            file_config = json.load(f)
+    else:
+        file_config = get_default_config()
+    file_config.setdefault(section, {}).update(values)
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(file_config, f, indent=2, ensure_ascii=False)
+    print(f"Calibration saved to {config_path}: {values}")
+
+
+def calibration_loop(phases, measure, compute_values, section):
+    """Guides the user through the calibration phases, saves the values computed from the samples
+    to the config section and stops the program"""
+    calibration["measure"] = measure
+    try:
+        for phase, prompt in phases:
+            calibration["prompt"] = prompt
+            print(f"[calibration] {prompt}")
+            if stop_event.wait(CALIBRATION_SETTLE_TIME):
+                return
+            calibration["samples"][phase] = []
+            calibration["phase"] = phase
+            if stop_event.wait(CALIBRATION_PHASE_TIME):
+                return
+            calibration["phase"] = None
+
+        values = compute_values(calibration["samples"])
+        if values:
+            save_calibration(section, values)
+    finally:
+        calibration["prompt"] = ""
+        stop_event.set()
+
+
+# ============ CURSOR MAPPING ============
+# The mapping turns a measure of the face into a screen position. Both methods map linearly:
+# the first value of a range is the left (top) screen edge, the second one the right (bottom) edge.
+#   "nose"      - position of the nose in the frame (normalised 0..1)
+#   "head_pose" - yaw and pitch of the head in degrees. Turning the head moves the cursor further
+#                 than shifting it, so the screen edges are reached with less motion
+# 3D head model (arbitrary units, only the proportions matter) in camera axes: x right, y down,
+# z away from the camera. MediaPipe places 33/61 on the left side of the image, 263/291 on the right
+HEAD_MODEL_POINTS = np.array([
+    (0.0, 0.0, 0.0),  # 1 nose tip
+    (0.0, 330.0, 65.0),  # 152 chin
+    (-225.0, -170.0, 135.0),  # 33 outer eye corner, left in the image
+    (225.0, -170.0, 135.0),  # 263 outer eye corner, right in the image
+    (-150.0, 150.0, 125.0),  # 61 mouth corner, left in the image
+    (150.0, 150.0, 125.0)  # 291 mouth corner, right in the image
+])
+HEAD_POSE_ROWS = [USED_LANDMARKS.index(landmark) for landmark in HEAD_POSE_LANDMARKS] \
+    if MAPPING_METHOD == "head_pose" else []
+MAPPING_CALIBRATION_PHASES = [
+    ("center", "Point your nose at the CENTER of the screen"),
+    ("left", "Point your nose at the LEFT edge of the screen"),
+    ("right", "Point your nose at the RIGHT edge of the screen"),
+    ("top", "Point your nose at the TOP edge of the screen"),
+    ("bottom", "Point your nose at the BOTTOM edge of the screen")
+]
+# where the phases are on the screen (0..1), None - the axis is not calibrated in this phase
+MAPPING_CALIBRATION_TARGETS = {
+    "center": (0.5, 0.5),
+    "left": (0.0, None),
+    "right": (1.0, None),
+    "top": (None, 0.0),
+    "bottom": (None, 1.0)
+}
+# solvePnP state: the previous pose is the starting point of the next solution
+head_pose = {"rvec": None, "tvec": None, "camera_matrix": None, "frame_size": None}
+
+
+def estimate_head_pose():
+    """Returns (yaw, pitch) of the head in degrees from face_points_scaled, None if solvePnP failed.
+    Positive yaw - the face turns to the right side of the (flipped) frame, positive pitch - up"""
+    frame_w, frame_h = frame_size
+    if head_pose["frame_size"] != (frame_w, frame_h):
+        # approximate pinhole camera: focal length about the frame width, no lens distortion
+        head_pose["camera_matrix"] = np.array([[frame_w, 0, frame_w / 2],
+                                               [0, frame_w, frame_h / 2],
+                                               [0, 0, 1]], dtype=float)
+        head_pose["frame_size"] = (frame_w, frame_h)
+        head_pose["rvec"] = None
+
+    image_points = face_points_scaled[HEAD_POSE_ROWS]
+    if head_pose["rvec"] is None:
+        ok, rvec, tvec = cv2.solvePnP(HEAD_MODEL_POINTS, image_points, head_pose["camera_matrix"], None)
+    else:
+        ok, rvec, tvec = cv2.solvePnP(HEAD_MODEL_POINTS, image_points, head_pose["camera_matrix"], None,
+                                      head_pose["rvec"], head_pose["tvec"], True)
+    if not ok:
+        head_pose["rvec"] = None
+        return None
+    head_pose["rvec"], head_pose["tvec"] = rvec, tvec
+
+    rotation, _ = cv2.Rodrigues(rvec)
+    forward = -rotation[:, 2]  # direction the face looks at, in camera axes
+    yaw = math.degrees(math.atan2(forward[0], -forward[2]))
+    pitch = math.degrees(math.atan2(-forward[1], -forward[2]))
+    return yaw, pitch
+
+
+def mapping_features():
+    """Returns the (x, y) measure of the configured mapping method, None if it is not available"""
+    if MAPPING_METHOD == "head_pose":
+        return estimate_head_pose()
+    return float(face_points[NOSE, 0]), float(face_points[NOSE, 1])
+
+
+def map_to_screen(value, value_range, screen_size):
+    return (value - value_range[0]) / (value_range[1] - value_range[0]) * screen_size
+
+
+def compute_calibrated_mapping(samples):
+    """Fits a line through the median measure of every phase and its screen target.
+    Returns the new mapping ranges, None if calibration failed"""
+    ranges = []
+    for axis in (0, 1):
+        values, targets = [], []
+        for phase, phase_samples in samples.items():
+            target = MAPPING_CALIBRATION_TARGETS[phase][axis]
+            if target is not None and phase_samples:
+                values.append(float(np.median([sample[axis] for sample in phase_samples])))
+                targets.append(target)
+        if len(values) < 3:
+            print("Calibration failed: the face was not visible in every step")
+            return None
+        slope, intercept = np.polyfit(values, targets, 1)
+        if abs(slope) < 1e-9:
+            print("Calibration failed: the head did not move between the steps. Please try again")
+            return None
+        # values where the line reaches the screen edges 0 and 1
+        ranges.append([round((0.0 - intercept) / slope, 4), round((1.0 - intercept) / slope, 4)])
+
+    if MAPPING_METHOD == "head_pose":
+        return {"yaw_range": ranges[0], "pitch_range": ranges[1]}
+    return {"nose_x_range": ranges[0], "nose_y_range": ranges[1]}
+
+
+# ============ INPUT BACKENDS ============
+# pyautogui is portable but spends noticeable time per call (argument parsing, failsafe checks,
+# platform dispatch). The other backends call the OS directly. All of them expose the same
+# three functions: move(x, y), click(), right_click().
+def create_pyautogui_backend():
+    return {
+        "name": "pyautogui",
+        # _pause=False: pyautogui would sleep PAUSE after every call while input_lock is held
+        "move": lambda x, y: pyautogui.moveTo(x, y, _pause=False),
+        "click": lambda: pyautogui.click(_pause=False),
+        "right_click": lambda: pyautogui.rightClick(_pause=False)
+    }
 
-cap = cv2.VideoCapture(camera)
-if not cap.isOpened():
-    print("Cannot open camera")
-    exit()
 
-face_mesh = mp.solutions.face_mesh.FaceMesh(refine_landmarks=True)
-screen_w, screen_h = pyautogui.size()
-x_screen_center = screen_w / 2
-y_screen_center = screen_h / 2
+def create_win32_backend():
+    """Windows: SetCursorPos / mouse_event from user32 through ctypes (no extra packages)"""
+    import ctypes
+    user32 = ctypes.windll.user32
+    mouseeventf_leftdown, mouseeventf_leftup = 0x0002, 0x0004
+    mouseeventf_rightdown, mouseeventf_rightup = 0x0008, 0x0010
 
+    def click(down, up):
+        user32.mouse_event(down, 0, 0, 0, 0)
+        user32.mouse_event(up, 0, 0, 0, 0)
+
+    return {
+        "name": "win32",
+        "move": lambda x, y: user32.SetCursorPos(int(x), int(y)),
+        "click": lambda: click(mouseeventf_leftdown, mouseeventf_leftup),
+        "right_click": lambda: click(mouseeventf_rightdown, mouseeventf_rightup)
+    }
+
+
+def create_xlib_backend():
+    """Linux (X11): XTest fake input through python-xlib (installed together with pyautogui).
+    Requests are only flushed, not synced, so a move does not wait for an X server round trip.
+    "sync" waits for the round trip, like pyautogui does after every move (used by the benchmark)"""
+    from Xlib import X, display
+    from Xlib.ext import xtest
+    xdisplay = display.Display()
+
+    def move(x, y):
+        xtest.fake_input(xdisplay, X.MotionNotify, x=int(x), y=int(y))
+        xdisplay.flush()
+
+    def click(button):
+        xtest.fake_input(xdisplay, X.ButtonPress, button)
+        xtest.fake_input(xdisplay, X.ButtonRelease, button)
+        xdisplay.flush()
+
+    return {
+        "name": "xlib",
+        "move": move,
+        "sync": xdisplay.sync,
+        "click": lambda: click(1),
+        "right_click": lambda: click(3)
+    }
+
+
+def create_quartz_backend():
+    """macOS: Quartz mouse events through pyobjc (installed together with pyautogui)"""
+    import Quartz
+
+    def post(event_type, x, y, button):
+        event = Quartz.CGEventCreateMouseEvent(None, event_type, (x, y), button)
+        Quartz.CGEventPost(Quartz.kCGHIDEventTap, event)
+
+    def click(down, up, button):
+        x, y = Quartz.CGEventGetLocation(Quartz.CGEventCreate(None))
+        post(down, x, y, button)
+        post(up, x, y, button)
+
+    return {
+        "name": "quartz",
+        "move": lambda x, y: post(Quartz.kCGEventMouseMoved, x, y, Quartz.kCGMouseButtonLeft),
+        "click": lambda: click(Quartz.kCGEventLeftMouseDown, Quartz.kCGEventLeftMouseUp,
+                               Quartz.kCGMouseButtonLeft),
+        "right_click": lambda: click(Quartz.kCGEventRightMouseDown, Quartz.kCGEventRightMouseUp,
+                                     Quartz.kCGMouseButtonRight)
+    }
+
+
+def create_none_backend():
+    """Does not touch the OS pointer. Used when no display is available and for replays/benchmarks"""
+    return {
+        "name": "none",
+        "move": lambda x, y: None,
+        "click": lambda: None,
+        "right_click": lambda: None
+    }
+
+
+INPUT_BACKENDS = {
+    "none": create_none_backend,
+    "pyautogui": create_pyautogui_backend,
+    "win32": create_win32_backend,
+    "xlib": create_xlib_backend,
+    "quartz": create_quartz_backend
+}
+
+
+def create_input_backend(name):
+    """Creates the requested input backend, falls back to pyautogui if it is not available here"""
+    if pyautogui is None:
+        return create_none_backend()
+    if name not in INPUT_BACKENDS:
+        print(f"Unknown input backend '{name}'. Using pyautogui")
+        return create_pyautogui_backend()
+    try:
+        return INPUT_BACKENDS[name]()
+    except Exception as e:
+        print(f"Input backend '{name}' is not available ({e}). Using pyautogui")
+        return create_pyautogui_backend()
+
+
+input_backend = create_pyautogui_backend() if pyautogui else create_none_backend()
+# moves come from the cursor thread and clicks from the action executor; backends such as
+# the Xlib connection are not safe to use from two threads at once
+input_lock = threading.Lock()
+
+
+def mouse_move(x, y):
+    with input_lock:
+        input_backend["move"](x, y)
+
+
+def mouse_click():
+    with input_lock:
+        input_backend["click"]()
+
+
+def mouse_right_click():
+    with input_lock:
+        input_backend["right_click"]()
+
+
+# ============ ACTION EXECUTOR ============
+# Clicks run in their own thread, so a slow OS call never stalls face tracking and the cursor.
+# Actions are executed one by one in the order they were submitted.
+action_queue = queue.Queue()
+action_thread = None
+
+
+def action_executor_loop():
+    """Runs submitted actions until the program stops"""
+    while not stop_event.is_set():
+        try:
+            action, args = action_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        stage_start = time.perf_counter()
+        try:
+            action(*args)
+        except Exception as e:
+            print(f"Action {action.__name__} failed: {e}")
+        record_stage_time("action", time.perf_counter() - stage_start)
+
+
+def submit_action(action, *args):
+    """Queues an action for the executor thread (the thread is started on first use)"""
+    global action_thread
+    if action_thread is None:
+        action_thread = threading.Thread(target=action_executor_loop, daemon=True)
+        action_thread.start()
+    action_queue.put((action, args))
+
+
+# ============ CURSOR OUTPUT THREAD ============
+# The vision loop only publishes a target position per camera frame. A separate thread moves the
+# OS pointer at CURSOR_OUTPUT_RATE_HZ, interpolating from the previous target to the new one over
+# the measured frame interval, so at 15-30 fps the pointer glides instead of stepping and the
+# vision loop never waits for OS input calls.
+cursor_target = {
+    "lock": threading.Lock(),
+    "from_x": None,
+    "from_y": None,
+    "to_x": None,
+    "to_y": None,
+    "start_time": 0.0,
+    "interval": 1 / 30,
+    "frame_time": None
+}
+
+
+def interpolated_cursor_position(now):
+    """Returns the pointer position between the previous and the current target (call with lock held)"""
+    if cursor_target["to_x"] is None:
+        return None, None
+    progress = min(1.0, (now - cursor_target["start_time"]) / cursor_target["interval"])
+    x = cursor_target["from_x"] + (cursor_target["to_x"] - cursor_target["from_x"]) * progress
+    y = cursor_target["from_y"] + (cursor_target["to_y"] - cursor_target["from_y"]) * progress
+    return x, y
+
+
+def set_cursor_target(x, y, frame_time):
+    """Publishes a new pointer target; the new segment starts where the pointer currently is"""
+    with cursor_target["lock"]:
+        now = time.time()
+        from_x, from_y = interpolated_cursor_position(now)
+        if from_x is None:
+            from_x, from_y = x, y
+
+        if cursor_target["frame_time"] is not None and frame_time > cursor_target["frame_time"]:
+            # clamp, so a hiccup of the camera does not turn into a very slow glide
+            cursor_target["interval"] = min(frame_time - cursor_target["frame_time"], 0.2)
+
+        cursor_target["from_x"] = from_x
+        cursor_target["from_y"] = from_y
+        cursor_target["to_x"] = x
+        cursor_target["to_y"] = y
+        cursor_target["start_time"] = now
+        cursor_target["frame_time"] = frame_time
+
+
+def cursor_output_loop():
+    """Cursor actuator: moves the pointer at a fixed rate towards the latest target"""
+    period = 1.0 / CURSOR_OUTPUT_RATE_HZ
+    last_x, last_y = None, None
+    next_tick = time.perf_counter()
+
+    while not stop_event.is_set():
+        if bln_cam_mouse_control:
+            with cursor_target["lock"]:
+                x, y = interpolated_cursor_position(time.time())
+            if x is not None:
+                x, y = int(round(x)), int(round(y))
+                if x != last_x or y != last_y:
+                    stage_start = time.perf_counter()
+                    mouse_move(x, y)
+                    record_stage_time("cursor_output", time.perf_counter() - stage_start)
+                    last_x, last_y = x, y
+
+        next_tick += period
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # we are late (e.g. the OS call was slow) - do not try to catch up with a burst of moves
+            next_tick = time.perf_counter()
+
+
+# ============ FRAME PIPELINE ============
+# Capture, processing and display run as separate stages. Stages exchange frames through
+# "latest frame wins" slots: a new frame replaces an unread one, so a slow stage drops old
+# frames instead of queueing them and camera-to-cursor latency stays bounded at one frame.
+def create_frame_slot():
+    """Creates a slot that holds only the newest frame.
+    landmarks are set only when replaying recorded/synthetic landmarks instead of running face mesh.
+    timestamp is the time of the frame in the session (the recorded time when replaying),
+    released is the wall clock time the frame entered the pipeline"""
+    return {"condition": threading.Condition(), "frame": None, "timestamp": 0.0, "released": 0.0, "frame_id": 0,
+            "landmarks": None, "taken_frame_id": 0}
+
+
+def put_frame(slot, frame, timestamp, landmarks=None, released=None):
+    """Stores a frame in the slot, replacing the previous one if it was not read yet"""
+    with slot["condition"]:
+        slot["frame"] = frame
+        slot["timestamp"] = timestamp
+        slot["released"] = timestamp if released is None else released
+        slot["landmarks"] = landmarks
+        slot["frame_id"] += 1
+        slot["condition"].notify_all()
+
+
+def get_frame(slot, last_frame_id, timeout=0.5):
+    """Waits for a frame newer than last_frame_id.
+    Returns (frame, timestamp, frame_id, landmarks, released), frame is None on timeout or stop"""
+    with slot["condition"]:
+        slot["condition"].wait_for(lambda: slot["frame_id"] != last_frame_id or stop_event.is_set(), timeout)
+        if slot["frame_id"] == last_frame_id:
+            return None, 0.0, last_frame_id, None, 0.0
+        slot["taken_frame_id"] = slot["frame_id"]
+        slot["condition"].notify_all()
+        return slot["frame"], slot["timestamp"], slot["frame_id"], slot["landmarks"], slot["released"]
+
+
+def wait_frame_taken(slot, timeout=1.0):
+    """Waits until the reader took the last frame. Used by replay in fast mode, where no frame may be dropped"""
+    with slot["condition"]:
+        slot["condition"].wait_for(lambda: slot["taken_frame_id"] == slot["frame_id"] or stop_event.is_set(),
+                                   timeout)
+
+
+camera_frame_slot = create_frame_slot()
+display_frame_slot = create_frame_slot()
+
+
+# ============ POWER SAVING ============
+# While the user is idle (no face, mouse control off or a still head) face mesh runs only
+# IDLE_FPS times per second. Any activity - a movement, a closed eye, an open mouth - switches
+# back to the full rate on the next processed frame.
+power_state = {"idle": False, "last_activity": time.time(), "last_processed": 0.0, "last_cursor": None}
+
+
+def skip_idle_frame(frame_time):
+    """Returns True if the frame should not be processed because the tracker is idle"""
+    if not power_state["idle"]:
+        return False
+    if frame_time - power_state["last_processed"] < 1.0 / IDLE_FPS:
+        return True
+    power_state["last_processed"] = frame_time
+    return False
+
+
+def update_power_state(face_found, now, cursor=None):
+    """Decides from the current frame whether the user is active.
+    cursor - screen position the face maps to (before filtering), None if it was not mapped in this frame"""
+    active = False
+    if face_found:
+        last_cursor = power_state["last_cursor"]
+        moved = cursor is not None and (last_cursor is None or
+                                        max(abs(cursor[0] - last_cursor[0]),
+                                            abs(cursor[1] - last_cursor[1])) > IDLE_MOTION_THRESHOLD)
+        if moved:
+            power_state["last_cursor"] = cursor
+        # gestures must stay responsive; cursor motion matters only if it moves the cursor or the menu is used
+        gesture_in_progress = bool(gesture_engine["prev_signal_state"].any())
+        controlling = bln_cam_mouse_control or USE_MENU_SYSTEM
+        active = gesture_in_progress or (controlling and (moved or not IDLE_WHEN_STILL))
+    else:
+        power_state["last_cursor"] = None
+
+    if active:
+        power_state["last_activity"] = now
+    idle = now - power_state["last_activity"] > IDLE_AFTER
+    if idle != power_state["idle"]:
+        power_state["idle"] = idle
+        print("Power saving: idle" if idle else "Power saving: active")
+
+
+# ============ STAGE TIMING ============
+# Every stage of the pipeline stores its durations here. The metrics thread turns them into
+# percentiles and histograms for the overlay, the metrics endpoint and the metrics file.
+STAGE_TIMING_HISTORY = METRICS_HISTORY_SIZE
+stage_timings = {}  # stage name -> durations in seconds (newest STAGE_TIMING_HISTORY values)
+# stages in pipeline order, "frame" is the whole processing of one frame
+METRICS_STAGES = ("capture", "flip", "convert", "face_mesh", "gestures", "filter", "cursor", "cursor_output",
+                  "action", "draw", "imshow", "frame", "latency")
+METRICS_HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 33, 50, 100)
+
+
+def record_stage_time(stage, duration):
+    """Stores how long a pipeline stage took (seconds)"""
+    history = stage_timings.get(stage)
+    if history is None:
+        history = stage_timings[stage] = deque(maxlen=STAGE_TIMING_HISTORY)
+    history.append(duration)
+
+
+def stage_statistics(stage):
+    """Returns count, mean, p50, p99 and max (milliseconds) of the recorded durations of a stage"""
+    values = sorted(stage_timings.get(stage, ()))
+    if not values:
+        return None
+    count = len(values)
+    # histogram: how many durations are <= each bound (cumulative, like Prometheus buckets)
+    histogram = {str(bound): bisect.bisect_right(values, bound / 1000) for bound in METRICS_HISTOGRAM_BOUNDS_MS}
+    histogram["inf"] = count
+    return {
+        "count": count,
+        "mean": sum(values) / count * 1000,
+        "p50": values[int(0.5 * (count - 1))] * 1000,
+        "p99": values[int(0.99 * (count - 1))] * 1000,
+        "max": values[-1] * 1000,
+        "histogram": histogram
+    }
+
+
+# ============ SCREEN GEOMETRY ============
+# The cursor is mapped to screen_area = (left, top, width, height) in desktop pixels. With several
+# monitors the virtual desktop can start at negative coordinates (a monitor left of the main one).
+# The layout is read again every SCREEN_REFRESH_INTERVAL seconds, so connecting a monitor or
+# changing the resolution does not need a restart.
+geometry_display = None  # Xlib connection used to read the screen size on Linux
+
+
+def get_x11_screen():
+    """Returns the current size of the X screen. Unlike pyautogui.size(), which keeps the size
+    from the start of its connection, it is asked from the X server every time"""
+    global geometry_display
+    if geometry_display is None:
+        from Xlib import display
+        geometry_display = display.Display()
+    geometry = geometry_display.screen().root.get_geometry()
+    return 0, 0, geometry.width, geometry.height
+
+
+def get_primary_screen():
+    if sys.platform not in ("win32", "darwin"):
+        # pyautogui reports the whole X screen as well, but never sees it change
+        try:
+            return get_x11_screen()
+        except Exception:
+            pass  # no python-xlib or no X server to ask
+    if pyautogui:
+        screen_w, screen_h = pyautogui.size()
+        return 0, 0, screen_w, screen_h
+    return 0, 0, 1920, 1080
+
+
+def get_virtual_desktop():
+    """Returns the bounding box of all monitors"""
+    if sys.platform == "win32":
+        # SM_XVIRTUALSCREEN, SM_YVIRTUALSCREEN, SM_CXVIRTUALSCREEN, SM_CYVIRTUALSCREEN
+        return tuple(ctypes.windll.user32.GetSystemMetrics(index) for index in (76, 77, 78, 79))
+
+    if sys.platform == "darwin":
+        import Quartz
+        _, display_ids, count = Quartz.CGGetActiveDisplayList(16, None, None)
+        bounds = [Quartz.CGDisplayBounds(display_id) for display_id in display_ids[:count]]
+        left = min(b.origin.x for b in bounds)
+        top = min(b.origin.y for b in bounds)
+        right = max(b.origin.x + b.size.width for b in bounds)
+        bottom = max(b.origin.y + b.size.height for b in bounds)
+        return int(left), int(top), int(right - left), int(bottom - top)
+
+    # X11: the root window spans all monitors
+    return get_x11_screen()
+
+
+def read_screen_area():
+    if SCREEN_AREA == "all":
+        try:
+            return get_virtual_desktop()
+        except Exception as e:
+            print(f"Could not read the monitor layout ({e}). Using the primary screen")
+    return get_primary_screen()
+
+
+def screen_geometry_loop():
+    """Re-reads the monitor layout periodically and switches the mapping to the new layout"""
+    global screen_area
+    while not stop_event.wait(SCREEN_REFRESH_INTERVAL):
+        try:
+            area = read_screen_area()
+        except Exception as e:
+            print(f"Could not read the screen size: {e}")
+            continue
+        if area != screen_area:
+            print(f"Screen layout changed: {screen_area} -> {area}")
+            screen_area = area
+
+
+screen_area = read_screen_area()
+
+
+# ============ MAIN PROGRAM ============
+face_mesh = None
+
+# classic nose box: its size stretched to the screen, centered on the frame center
+# (or at 0.7 of the frame height with nose_center = false)
 lx = 0.4
 rx = 0.57
-lrx = (lx + rx) / 2
-screen_w_lambdax = screen_w / abs(lx - rx)
-halfx = screen_w / 2
-
 uy = 0.65
 ly = 0.79
-ulx = (uy + ly) / 2
-screen_h_lambday = screen_h / abs(uy - ly)
-halfy = screen_h / 2
+nose_center_y = 0.5 if bln_nose_center else 0.7
+
+if MAPPING_METHOD == "head_pose":
+    mapping_x_range, mapping_y_range = MAPPING_YAW_RANGE, MAPPING_PITCH_RANGE
+else:
+    mapping_x_range = MAPPING_NOSE_X_RANGE or [0.5 - abs(lx - rx) / 2, 0.5 + abs(lx - rx) / 2]
+    mapping_y_range = MAPPING_NOSE_Y_RANGE or [nose_center_y - abs(uy - ly) / 2, nose_center_y + abs(uy - ly) / 2]
 
 previous_x = 0
 previous_y = 0
 previous_x_threshold = 0
 previous_y_threshold = 0
+position_history_x = create_median_history()
+position_history_y = create_median_history()
+one_euro_state_x = create_one_euro_state()
+one_euro_state_y = create_one_euro_state()
+kalman_state_x = create_kalman_state()
+kalman_state_y = create_kalman_state()
+prediction_state_x = create_prediction_state()
+prediction_state_y = create_prediction_state()
+
+
+def draw_status_overlay(frame):
+    """Draws nose point, center circle, ROI box and status texts on the preview frame"""
+    frame_h, frame_w, _ = frame.shape
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("Can't receive frame (stream end?). Exiting ...")
-        break
-
+    cv2.circle(frame, face_points_px[NOSE], 7, (0, 255, 0))
+    cv2.circle(frame, (int(frame_w / 2), int(frame_h / 2)), 31, (0, 128, 0), 5)
+
+    if roi_box is not None:
+        cv2.rectangle(frame, roi_box[:2], roi_box[2:], (128, 128, 128), 1)
+
+    if POWER_SAVING and power_state["idle"]:
+        cv2.putText(frame, "POWER SAVING", (frame_w - 250, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (128, 128, 128), 2)
+
+    control_status = "MOUSE CONTROL: ON" if bln_cam_mouse_control else "MOUSE CONTROL: OFF"
+    status_color = (0, 255, 0) if bln_cam_mouse_control else (0, 0, 255)
+    cv2.putText(frame, control_status, (frame_w - 250, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, status_color, 2)
+
+    if USE_MENU_SYSTEM:
+        menu_status = "MENU SYSTEM: CONNECTED" if menu_socket else "MENU SYSTEM: DISCONNECTED"
+        menu_status_color = (0, 255, 0) if menu_socket else (0, 0, 255)
+        cv2.putText(frame, menu_status, (frame_w - 300, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, menu_status_color, 2)
+
+    current_time = time.time()
+    if last_action and (current_time - last_action_time) < LAST_ACTION_DISPLAY_TIME:
+        cv2.putText(frame, f"Last action: {last_action}", (frame_w - 500, frame_h - 60), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.7, (0, 255, 255), 2)
+
+
+def draw_metrics_overlay(frame):
+    """Draws p50/p99 of every stage from the latest metrics snapshot. Stages over the frame budget are red"""
+    stages = metrics_snapshot.get("stages")
+    if not stages:
+        return
+    frame_h, _, _ = frame.shape
+    y = frame_h - 20 * len(stages) - 10
+    for stage, stats in stages.items():
+        color = (0, 0, 255) if stats["p99"] > METRICS_FRAME_BUDGET_MS else (255, 255, 255)
+        cv2.putText(frame, f"{stage:<13} p50 {stats['p50']:6.1f}  p99 {stats['p99']:6.1f} ms", (10, y),
+                    cv2.FONT_HERSHEY_PLAIN, 1.0, color, 1)
+        y += 20
+
+
+def process_frame(frame, frame_time, recorded_landmarks=None, released=None):
+    """Process one camera frame captured at frame_time: face mesh, gestures, cursor movement and overlay.
+    recorded_landmarks replace face mesh when replaying a landmark stream.
+    Gestures, filters and prediction run on the session clock (frame_time), so a replay reproduces the
+    recorded session at any speed. released is the wall clock time the frame entered the pipeline
+    (equal to frame_time for a live camera), it is used for the latency measurement.
+    Returns the annotated frame for the display stage or None if nothing should be shown"""
+    global prev_frame_time, new_frame_time
+    global smoothed_x, smoothed_y, previous_x, previous_y, previous_x_threshold, previous_y_threshold
+
+    stage_start = time.perf_counter()
     frame = cv2.flip(frame, 1)
+    record_stage_time("flip", time.perf_counter() - stage_start)
 
-    if bln_display_fps:
+    if bln_display_fps and not HEADLESS:
         new_frame_time = time.time()
         fps = 1 / (new_frame_time - prev_frame_time)
         prev_frame_time = new_frame_time
@@ -311,206 +1856,80 @@ while True:
         fps = str(fps)
         cv2.putText(frame, fps, (7, 70), cv2.FONT_HERSHEY_SIMPLEX, 3, (100, 255, 0), 3, cv2.LINE_AA)
 
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    output = face_mesh.process(rgb_frame)
-    landmark_points = output.multi_face_landmarks
+    if recorded_landmarks is None:
+        face_found = detect_face_landmarks(frame)
+    else:
+        face_found = load_recorded_landmarks(recorded_landmarks, frame)
     frame_h, frame_w, _ = frame.shape
+    if released is None:
+        released = frame_time
+    # session clock minus wall clock: 0 for a live camera, the replay shift otherwise
+    clock_offset = frame_time - released
 
-    if landmark_points:
-        bln_left_eye_closed = False
-        bln_right_eye_closed = False
-        bln_mouth_open = False
-
-        landmarks = landmark_points[0].landmark
-
-        right = [landmarks[386], landmarks[374]]
-        for landmark in right:
-            x = int(landmark.x * frame_w)
-            y = int(landmark.y * frame_h)
-            cv2.circle(frame, (x, y), 3, (0, 255, 0))
-            if (right[1].y - right[0].y) < EYE_CLOSE_THRESHOLD:
-                bln_right_eye_closed = True
-
-        left = [landmarks[145], landmarks[159]]
-        for landmark in left:
-            x = int(landmark.x * frame_w)
-            y = int(landmark.y * frame_h)
-            cv2.circle(frame, (x, y), 3, (255, 0, 0))
-            if (left[0].y - left[1].y) < EYE_CLOSE_THRESHOLD:
-                bln_left_eye_closed = True
-
-        lip_upper = landmarks[13]
-        x = int(lip_upper.x * frame_w)
-        y = int(lip_upper.y * frame_h)
-        cv2.circle(frame, (x, y), 3, (0, 0, 255))
-
-        lip_down = landmarks[14]
-        x = int(lip_down.x * frame_w)
-        y = int(lip_down.y * frame_h)
-        cv2.circle(frame, (x, y), 3, (0, 0, 255))
-
-        lip_distance_diff = lip_down.y - lip_upper.y
-        if lip_distance_diff > MOUTH_OPEN_THRESHOLD:
-            bln_mouth_open = True
-
-        current_time = time.time()
-        left_eye_closed = bln_left_eye_closed
-        right_eye_closed = bln_right_eye_closed
-        mouth_open = bln_mouth_open
-
-        if eye_switch_cooldown and (current_time - eye_switch_cooldown_time) > EYE_SWITCH_COOLDOWN_DURATION:
-            eye_switch_cooldown = False
-
-        if right_eye_right_click_cooldown and (
-                current_time - right_eye_right_click_cooldown_time) > RIGHT_EYE_RIGHT_CLICK_COOLDOWN_DURATION:
-            right_eye_right_click_cooldown = False
-
-        if mouth_right_click_cooldown and (
-                current_time - mouth_right_click_cooldown_time) > MOUTH_RIGHT_CLICK_COOLDOWN_DURATION:
-            mouth_right_click_cooldown = False
-
-        if mouth_click_cooldown and (current_time - mouth_click_cooldown_time) > MOUTH_CLICK_COOLDOWN_DURATION:
-            mouth_click_cooldown = False
-
-        if mouth_menu_selection_cooldown and (
-                current_time - mouth_menu_selection_cooldown_time) > MOUTH_MENU_SELECTION_COOLDOWN_DURATION:
-            mouth_menu_selection_cooldown = False
-
-        # Left eye logic
-        if left_eye_closed:
-            if not prev_left_eye_closed and not eye_switch_cooldown:
-                left_eye_closed_start_time = current_time
-
-            if left_eye_closed_start_time is not None and not eye_switch_cooldown:
-                elapsed_time = current_time - left_eye_closed_start_time
-                progress_width = int((elapsed_time / LEFT_EYE_CLOSE_TIME_THRESHOLD) * 200)
-                cv2.rectangle(frame, (10, 50), (10 + progress_width, 70), (0, 255, 0), -1)
-                cv2.rectangle(frame, (10, 50), (210, 70), (255, 255, 255), 1)
-                cv2.putText(frame, "MOUSE CONTROL ON/OFF PROGRESS ...", (220, 65), cv2.FONT_HERSHEY_SIMPLEX, 0.7,
-                            (0, 255, 255), 2)
-
-                if elapsed_time >= LEFT_EYE_CLOSE_TIME_THRESHOLD:
-                    bln_cam_mouse_control = not bln_cam_mouse_control
-                    left_eye_closed_start_time = None
-                    eye_switch_cooldown = True
-                    eye_switch_cooldown_time = current_time
-                    status = "ENABLED" if bln_cam_mouse_control else "DISABLED"
-                    action_text = f"Mouse control {status}"
-                    set_last_action(action_text)
-                    cv2.putText(frame, f"Mouse control {status}!", (frame_w // 2 - 100, 50), cv2.FONT_HERSHEY_SIMPLEX,
-                                1, (0, 255, 0) if bln_cam_mouse_control else (0, 0, 255), 2)
-                    print(f"Mouse control {status}")
-        else:
-            left_eye_closed_start_time = None
-
-        # Right eye logic
-        if right_eye_closed:
-            if not prev_right_eye_closed and not right_eye_right_click_cooldown:
-                right_eye_closed_start_time = current_time
-
-            if right_eye_closed_start_time is not None and not right_eye_right_click_cooldown:
-                elapsed_time = current_time - right_eye_closed_start_time
-                progress_width = int((elapsed_time / RIGHT_EYE_RIGHT_CLICK_TIME_THRESHOLD) * 200)
-                cv2.rectangle(frame, (10, 120), (10 + progress_width, 140), (255, 0, 0), -1)
-                cv2.rectangle(frame, (10, 120), (210, 140), (255, 255, 255), 1)
-                cv2.putText(frame, f"RIGHT CLICK PROGRESS ...", (220, 135), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0),
-                            2)
-
-                if elapsed_time >= RIGHT_EYE_RIGHT_CLICK_TIME_THRESHOLD:
-                    if bln_cam_mouse_control:
-                        pyautogui.rightClick()
-                        action_text = "Right click (right eye)"
-                        set_last_action(action_text)
-                        print("Right click performed (right eye)")
-                        pyautogui.sleep(0.5)
-                    right_eye_closed_start_time = None
-                    right_eye_right_click_cooldown = True
-                    right_eye_right_click_cooldown_time = current_time
-        else:
-            right_eye_closed_start_time = None
-
-        # Mouth logic
-        if mouth_open:
-            if not prev_mouth_open:
-                mouth_open_start_time = current_time
-
-                if USE_MENU_SYSTEM and not mouth_menu_selection_cooldown and not mouth_click_cooldown:
-                    if send_menu_command("select_current_item"):
-                        action_text = "Menu selection (mouth open)"
-                        set_last_action(action_text)
-                        cv2.putText(frame, "Menu selection sent!", (frame_w // 2 - 100, 200), cv2.FONT_HERSHEY_SIMPLEX,
-                                    0.7, (0, 255, 255), 2)
-                        mouth_menu_selection_cooldown = True
-                        mouth_menu_selection_cooldown_time = current_time
-                    else:
-                        print("Could not send command to AbleMouse Beyond Switch server")
-                elif bln_cam_mouse_control and not mouth_click_cooldown and not USE_MENU_SYSTEM:
-                    pyautogui.click()
-                    action_text = "Left click"
-                    set_last_action(action_text)
-                    print("Click performed at mouth open start")
-                    mouth_click_cooldown = True
-                    mouth_click_cooldown_time = current_time
-
-            if not USE_MENU_SYSTEM and mouth_open_start_time is not None and not mouth_right_click_cooldown:
-                elapsed_time = current_time - mouth_open_start_time
-                progress_width = int((elapsed_time / MOUTH_OPEN_RIGHT_CLICK_TIME_THRESHOLD) * 200)
-                cv2.rectangle(frame, (10, 190), (10 + progress_width, 210), (255, 255, 0), -1)
-                cv2.rectangle(frame, (10, 190), (210, 210), (255, 255, 255), 1)
-                cv2.putText(frame, "RIGHT CLICK PROGRESS ...", (220, 205), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0),
-                            2)
-
-                if elapsed_time >= MOUTH_OPEN_RIGHT_CLICK_TIME_THRESHOLD:
-                    if bln_cam_mouse_control:
-                        pyautogui.rightClick()
-                        action_text = "Right click (mouth open hold)"
-                        set_last_action(action_text)
-                        print("Right click performed (mouth open hold)")
-                        pyautogui.sleep(0.5)
-                    mouth_open_start_time = None
-                    mouth_right_click_cooldown = True
-                    mouth_right_click_cooldown_time = current_time
+    if recorder:
+        record_landmarks(frame_time, face_found, frame_w, frame_h)
+
+    if POWER_SAVING and not face_found:
+        update_power_state(False, frame_time)
+
+    if face_found:
+        stage_start = time.perf_counter()
+
+        current_time = frame_time
+        calibration_phase = calibration["phase"]
+        if calibration_phase is not None:
+            collect_calibration_sample(calibration_phase)
         else:
-            mouth_open_start_time = None
+            fired, progress = evaluate_gestures(gesture_engine, face_points, face_points_scaled, current_time,
+                                                USE_MENU_SYSTEM)
+            for index in fired:
+                gesture = gesture_engine["gestures"][index]
+                performed = GESTURE_ACTIONS[gesture["action"]](frame, gesture)
+                finish_gesture(gesture_engine, index, performed, current_time)
 
-        prev_left_eye_closed = left_eye_closed
-        prev_right_eye_closed = right_eye_closed
-        prev_mouth_open = mouth_open
+            if not HEADLESS:
+                draw_gesture_overlay(frame, gesture_engine, progress)
 
-        nose_landmark = landmarks[94]
+        record_stage_time("gestures", time.perf_counter() - stage_start)
+
+        stage_start = time.perf_counter()
+        nose_x = float(face_points[NOSE, 0])
+        nose_y = float(face_points[NOSE, 1])
 
         if bln_do_not_move_cursor_if_xy_move_within_threshold:
             skip = False
-            if (abs(nose_landmark.x - previous_x_threshold) < SKIP_X_THRESHOLD) and \
-                    (abs(nose_landmark.y - previous_y_threshold) < SKIP_Y_THRESHOLD):
+            if (abs(nose_x - previous_x_threshold) < SKIP_X_THRESHOLD) and \
+                    (abs(nose_y - previous_y_threshold) < SKIP_Y_THRESHOLD):
                 skip = True
-            previous_x_threshold = nose_landmark.x
-            previous_y_threshold = nose_landmark.y
+            previous_x_threshold = nose_x
+            previous_y_threshold = nose_y
             if skip:
-                continue
-
-        x = int(nose_landmark.x * frame_w)
-        y = int(nose_landmark.y * frame_h)
-        cv2.circle(frame, (x, y), 7, (0, 255, 0))
-
-        screen_x = (nose_landmark.x - 0.5) * screen_w_lambdax + halfx
-        if bln_nose_center:
-            screen_y = (nose_landmark.y - 0.5) * screen_h_lambday + halfy
-        else:
-            screen_y = (nose_landmark.y - 0.7) * screen_h_lambday + halfy
-
-        if screen_x > screen_w:
-            screen_x = screen_w - 5
-        if screen_x < 0:
-            screen_x = 5
-        if screen_y > screen_h:
-            screen_y = screen_h - 5
-        if screen_y < 0:
-            screen_y = 5
+                if POWER_SAVING:
+                    update_power_state(True, current_time)
+                return None
+
+        features = mapping_features()
+        if features is None:
+            if POWER_SAVING:
+                update_power_state(True, current_time)
+            return frame
+        screen_left, screen_top, screen_w, screen_h = screen_area
+        screen_x = screen_left + map_to_screen(features[0], mapping_x_range, screen_w)
+        screen_y = screen_top + map_to_screen(features[1], mapping_y_range, screen_h)
+
+        if screen_x > screen_left + screen_w:
+            screen_x = screen_left + screen_w - SCREEN_EDGE_MARGIN
+        if screen_x < screen_left:
+            screen_x = screen_left + SCREEN_EDGE_MARGIN
+        if screen_y > screen_top + screen_h:
+            screen_y = screen_top + screen_h - SCREEN_EDGE_MARGIN
+        if screen_y < screen_top:
+            screen_y = screen_top + SCREEN_EDGE_MARGIN
+
+        if POWER_SAVING:
+            update_power_state(True, current_time, (screen_x, screen_y))
 
         # Apply filters
-        raw_screen_x, raw_screen_y = screen_x, screen_y
-
         if USE_MEDIAN_FILTER:
             screen_x, screen_y = apply_median_filter(screen_x, screen_y,
                                                      position_history_x,
@@ -522,40 +1941,568 @@ while True:
                                                              smoothed_x, smoothed_y,
                                                              SMOOTHING_ALPHA)
             smoothed_x, smoothed_y = screen_x, screen_y
+        elif FILTER_METHOD == 'one_euro':
+            screen_x = apply_one_euro_filter(one_euro_state_x, screen_x, frame_time,
+                                             ONE_EURO_MIN_CUTOFF, ONE_EURO_BETA, ONE_EURO_D_CUTOFF)
+            screen_y = apply_one_euro_filter(one_euro_state_y, screen_y, frame_time,
+                                             ONE_EURO_MIN_CUTOFF, ONE_EURO_BETA, ONE_EURO_D_CUTOFF)
+        elif FILTER_METHOD == 'kalman':
+            screen_x = apply_kalman_filter(kalman_state_x, screen_x, frame_time,
+                                           KALMAN_PROCESS_NOISE, KALMAN_MEASUREMENT_NOISE)
+            screen_y = apply_kalman_filter(kalman_state_y, screen_y, frame_time,
+                                           KALMAN_PROCESS_NOISE, KALMAN_MEASUREMENT_NOISE)
+
+        if USE_LATENCY_COMPENSATION:
+            now = time.time() + clock_offset
+            screen_x = apply_latency_compensation(prediction_state_x, screen_x, frame_time, now)
+            screen_y = apply_latency_compensation(prediction_state_y, screen_y, frame_time, now)
+            screen_x = min(max(screen_x, screen_left + SCREEN_EDGE_MARGIN),
+                           screen_left + screen_w - SCREEN_EDGE_MARGIN)
+            screen_y = min(max(screen_y, screen_top + SCREEN_EDGE_MARGIN),
+                           screen_top + screen_h - SCREEN_EDGE_MARGIN)
 
         if should_update_cursor(screen_x, screen_y, previous_x, previous_y, MOVE_THRESHOLD_PIXELS):
             final_x, final_y = screen_x, screen_y
         else:
             final_x, final_y = previous_x, previous_y
+        record_stage_time("filter", time.perf_counter() - stage_start)
 
+        stage_start = time.perf_counter()
         if bln_cam_mouse_control:
-            pyautogui.moveTo(final_x, final_y, _pause=False)
+            if USE_CURSOR_THREAD:
+                set_cursor_target(final_x, final_y, frame_time)
+            else:
+                mouse_move(final_x, final_y)
+        record_stage_time("cursor", time.perf_counter() - stage_start)
+        # camera-to-cursor latency: from the moment the frame was captured to the cursor command
+        record_stage_time("latency", time.time() - released)
 
         previous_x = final_x
         previous_y = final_y
 
-        cv2.circle(frame, (int(frame_w / 2), int(frame_h / 2)), 31, (0, 128, 0), 5)
+        if not HEADLESS:
+            stage_start = time.perf_counter()
+            draw_status_overlay(frame)
+            record_stage_time("draw", time.perf_counter() - stage_start)
+
+    if SHOW_METRICS_OVERLAY and not HEADLESS:
+        draw_metrics_overlay(frame)
+
+    if calibration["prompt"] and not HEADLESS:
+        cv2.putText(frame, calibration["prompt"], (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
+
+    return frame
+
+
+def capture_loop(cap):
+    """Capture stage: reads camera frames as fast as the driver delivers them.
+    Only the newest frame is kept, so a slow processing stage never works on stale frames"""
+    global captured_frames
+    camera_fps = cap.get(cv2.CAP_PROP_FPS)
+    capture_idle = False
+    while not stop_event.is_set():
+        if IDLE_CAPTURE_FPS and power_state["idle"] != capture_idle:
+            # the camera itself delivers fewer frames while idle (less USB and decoding work)
+            capture_idle = power_state["idle"]
+            cap.set(cv2.CAP_PROP_FPS, IDLE_CAPTURE_FPS if capture_idle else camera_fps)
+
+        stage_start = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            print("Can't receive frame (stream end?). Exiting ...")
+            stop_event.set()
+            break
+        timestamp = time.time()
+        record_stage_time("capture", time.perf_counter() - stage_start)
+        captured_frames += 1
+
+        if recorder:
+            recorder["video"].write(frame)
+            recorder["timestamps"].write(f"{timestamp:.6f}\n")
+
+        put_frame(camera_frame_slot, frame, timestamp)
+
+
+def vision_loop():
+    """Processing stage: face mesh, gestures and cursor on the newest captured frame"""
+    global processed_frames
+    frame_id = 0
+    try:
+        while not stop_event.is_set():
+            frame, frame_time, frame_id, landmarks, released = get_frame(camera_frame_slot, frame_id)
+            if frame is None:
+                continue
+            if POWER_SAVING and skip_idle_frame(frame_time):
+                continue
+
+            stage_start = time.perf_counter()
+            frame = process_frame(frame, frame_time, landmarks, released)
+            record_stage_time("frame", time.perf_counter() - stage_start)
+            processed_frames += 1
+            if frame is not None and not HEADLESS:
+                put_frame(display_frame_slot, frame, frame_time)
+    finally:
+        # an error in processing must stop the whole program, not only this thread
+        stop_event.set()
+
+
+# ============ RECORD AND REPLAY ============
+# --record DIR saves the raw camera frames (frames.avi), their capture times (frames.csv) and the
+# extracted landmarks (landmarks.jsonl, the first line lists the MediaPipe index of every point
+# row, as the rows depend on the configuration). --replay feeds a recording, any video file or a synthetic
+# landmark stream into the same pipeline instead of the camera, so the tracker can be measured
+# without a webcam and a person in front of it.
+RECORDING_VIDEO = "frames.avi"
+RECORDING_TIMESTAMPS = "frames.csv"
+RECORDING_LANDMARKS = "landmarks.jsonl"
+REPLAY_FRAME_SIZE = (640, 480)  # width, height of the blank frame for landmarks recorded without frame_size
+
+
+def start_recording(directory, cap):
+    """Opens recording files in directory"""
+    global recorder
+    os.makedirs(directory, exist_ok=True)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    recorder = {
+        "video": cv2.VideoWriter(os.path.join(directory, RECORDING_VIDEO), cv2.VideoWriter_fourcc(*"MJPG"),
+                                 fps, (width, height)),
+        "timestamps": open(os.path.join(directory, RECORDING_TIMESTAMPS), "w", encoding="utf-8"),
+        "landmarks": open(os.path.join(directory, RECORDING_LANDMARKS), "w", encoding="utf-8")
+    }
+    recorder["landmarks"].write(json.dumps({"landmarks": USED_LANDMARKS}) + "\n")
+    print(f"Recording session to {directory}")
+
+
+def stop_recording():
+    global recorder
+    if recorder:
+        recorder["video"].release()
+        recorder["timestamps"].close()
+        recorder["landmarks"].close()
+        recorder = None
+
+
+def record_landmarks(frame_time, face_found, frame_w, frame_h):
+    """Appends landmarks of the current frame (empty list if no face was found) to the recording"""
+    points = face_points.tolist() if face_found else []
+    recorder["landmarks"].write(json.dumps({"timestamp": frame_time, "frame_size": [frame_w, frame_h],
+                                            "points": points}) + "\n")
 
-        control_status = "MOUSE CONTROL: ON" if bln_cam_mouse_control else "MOUSE CONTROL: OFF"
-        status_color = (0, 255, 0) if bln_cam_mouse_control else (0, 0, 255)
-        cv2.putText(frame, control_status, (frame_w - 250, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, status_color, 2)
 
+def load_recorded_landmarks(points, frame):
+    """Replay counterpart of detect_face_landmarks: fills face_points from a recorded/synthetic stream"""
+    if len(points) == 0:
+        return False
+    face_points[:] = points
+    frame_h, frame_w, _ = frame.shape
+    update_pixel_coordinates(frame_w, frame_h)
+    return True
+
+
+def read_recorded_timestamps(directory):
+    path = os.path.join(directory, RECORDING_TIMESTAMPS)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [float(line) for line in f if line.strip()]
+
+
+def recorded_landmark_rows(directory):
+    """Returns the rows of the recorded points in USED_LANDMARKS order, None if the rows can be used as they are.
+    Raises ValueError if the recording lacks a landmark the current configuration needs"""
+    with open(os.path.join(directory, RECORDING_LANDMARKS), "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "landmarks" in record:
+                recorded = record["landmarks"]
+                missing = [landmark for landmark in USED_LANDMARKS if landmark not in recorded]
+                if missing:
+                    raise ValueError(f"landmarks {missing} needed by the current configuration were not recorded")
+                return [recorded.index(landmark) for landmark in USED_LANDMARKS]
+            # older recordings do not list their landmarks: usable only with the same number of rows
+            if record["points"]:
+                if len(record["points"]) != len(USED_LANDMARKS):
+                    raise ValueError("the recording was made with other gesture signals or mapping settings")
+                return None
+    return None
+
+
+def read_recorded_landmarks(directory, rows=None):
+    """Yields (recorded time, points, (frame width, frame height)) from landmarks.jsonl of a recording.
+    rows - see recorded_landmark_rows"""
+    with open(os.path.join(directory, RECORDING_LANDMARKS), "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if "timestamp" not in record:
+                    continue
+                points = record["points"]
+                if points and rows is not None:
+                    points = np.asarray(points)[rows]
+                yield record["timestamp"], points, tuple(record.get("frame_size", REPLAY_FRAME_SIZE))
+
+
+def synthetic_landmark_stream(frames, fps=30):
+    """Yields (time, points, frame size) of a synthetic face: the nose draws a Lissajous figure over the screen,
+    the left eye closes for 2 s every 10 s (control toggle), the mouth opens for 0.3 s every 7 s (click)"""
+    points = np.zeros((len(USED_LANDMARKS), 3))
+    rows = {landmark: row for row, landmark in enumerate(USED_LANDMARKS)}
+
+    def place_opening(center_x, center_y, width, gap, corners, pairs):
+        """Places corner landmarks and upper/lower landmark pairs of an eye or the mouth"""
+        for landmark, x in zip(corners, (center_x - width / 2, center_x + width / 2)):
+            if landmark in rows:
+                points[rows[landmark], :2] = x, center_y
+        for upper, lower in pairs:
+            if upper in rows:
+                points[rows[upper], 1] = center_y - gap / 2
+            if lower in rows:
+                points[rows[lower], 1] = center_y + gap / 2
+
+    for i in range(frames):
+        t = i / fps
+        nose_x = 0.485 + 0.06 * math.sin(2 * math.pi * t / 4)
+        nose_y = 0.72 + 0.05 * math.sin(2 * math.pi * t / 3)
+        left_eye_gap = 0.002 if 5 <= t % 10 < 7 else 0.02
+        mouth_gap = 0.02 if t % 7 < 0.3 else 0.001
+
+        points[:, 0] = nose_x
+        points[:, 1] = nose_y
+        place_opening(nose_x + 0.04, nose_y - 0.11, 0.05, 0.02, (362, 263), [(386, 374), (385, 380), (387, 373)])
+        place_opening(nose_x - 0.04, nose_y - 0.11, 0.05, left_eye_gap, (33, 133),
+                      [(159, 145), (160, 144), (158, 153)])
+        place_opening(nose_x, nose_y + 0.06, 0.08, mouth_gap, (61, 291), [(13, 14), (81, 178), (311, 402)])
+        points[FACE_BOUNDARY, 0] = nose_x + np.array([0.0, 0.0, -0.1, 0.1])
+        points[FACE_BOUNDARY, 1] = nose_y + np.array([-0.3, 0.15, -0.1, -0.1])
+        yield t, points.tolist(), REPLAY_FRAME_SIZE
+
+
+def replay_video_loop(cap, timestamps, realtime):
+    """Capture stage for replay of a video file. In realtime mode frames are released at their recorded
+    pace, so slow processing drops frames as with a live camera. Otherwise every frame is processed.
+    Frames carry their recorded time shifted to the start of the replay, in both modes"""
+    global captured_frames
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    replay_start = time.time()
+    first_time = None
+    index = 0
+
+    while not stop_event.is_set():
+        stage_start = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            print("Replay finished")
+            stop_event.set()
+            break
+        record_stage_time("capture", time.perf_counter() - stage_start)
+
+        recorded_time = timestamps[index] if index < len(timestamps) else index / fps
+        index += 1
+        if first_time is None:
+            first_time = recorded_time
+
+        frame_time = replay_start + (recorded_time - first_time)
+        if realtime:
+            delay = frame_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            wait_frame_taken(camera_frame_slot)
+
+        captured_frames += 1
+        put_frame(camera_frame_slot, frame, frame_time, released=time.time())
+
+
+def replay_landmarks_loop(landmark_stream, realtime):
+    """Capture stage for replay of recorded or synthetic landmarks: face mesh is skipped,
+    a blank frame of the recorded size carries the landmarks through the pipeline"""
+    global captured_frames
+    blank_frames = {}  # (width, height) -> blank frame
+    replay_start = time.time()
+    first_time = None
+
+    for recorded_time, points, frame_size in landmark_stream:
+        if stop_event.is_set():
+            return
+        if first_time is None:
+            first_time = recorded_time
+        blank_frame = blank_frames.get(frame_size)
+        if blank_frame is None:
+            blank_frame = blank_frames[frame_size] = np.zeros((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+
+        frame_time = replay_start + (recorded_time - first_time)
+        if realtime:
+            delay = frame_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            wait_frame_taken(camera_frame_slot)
+
+        captured_frames += 1
+        put_frame(camera_frame_slot, blank_frame, frame_time, points, released=time.time())
+
+    if not realtime:
+        wait_frame_taken(camera_frame_slot)
+    print("Replay finished")
+    stop_event.set()
+
+
+def open_frame_source(replay=None, replay_landmarks=False, realtime=True, synthetic_frames=1800):
+    """Prepares the capture stage.
+    replay: None - live camera, "synthetic" - synthetic landmark stream, a recording directory or a video file.
+    Returns (capture stage function, its arguments, cap); the function is None if the source cannot be opened"""
+    if replay is None:
+        cap = open_camera()
+        if not cap.isOpened():
+            return None, None, cap
+        return capture_loop, (cap,), cap
+
+    if replay == "synthetic":
+        return replay_landmarks_loop, (synthetic_landmark_stream(synthetic_frames), realtime), None
+
+    if os.path.isdir(replay) and replay_landmarks:
+        try:
+            rows = recorded_landmark_rows(replay)
+        except (OSError, ValueError) as e:
+            print(f"Cannot replay landmarks of {replay}: {e}")
+            return None, None, None
+        return replay_landmarks_loop, (read_recorded_landmarks(replay, rows), realtime), None
+
+    if os.path.isdir(replay):
+        cap = cv2.VideoCapture(os.path.join(replay, RECORDING_VIDEO))
+        timestamps = read_recorded_timestamps(replay)
+    else:
+        cap = cv2.VideoCapture(replay)
+        timestamps = []
+    if not cap.isOpened():
+        return None, None, cap
+    return replay_video_loop, (cap, timestamps, realtime), cap
+
+
+def display_loop():
+    """Display stage: shows the latest processed frame. Runs in the main thread (HighGUI requirement)"""
+    frame_id = 0
+    while not stop_event.is_set():
+        frame, _, new_frame_id, _, _ = get_frame(display_frame_slot, frame_id, timeout=0.03)
+        stage_start = time.perf_counter()
+        if frame is not None:
+            frame_id = new_frame_id
+            cv2.imshow('Gagarin Data Labs -> AbleMouse AI edition', frame)
+
+        key = cv2.waitKey(1) & 0xFF
+        if frame is not None:
+            # imshow + waitKey: the window is actually repainted inside waitKey
+            record_stage_time("imshow", time.perf_counter() - stage_start)
+        if key == ord('q'):
+            stop_event.set()
+
+
+def status_log_loop():
+    """Headless replacement of the display stage: periodically prints the tracker status"""
+    last_frames = processed_frames
+    last_time = time.time()
+    while not stop_event.wait(STATUS_LOG_INTERVAL):
+        now = time.time()
+        fps = (processed_frames - last_frames) / (now - last_time)
+        last_frames, last_time = processed_frames, now
+
+        control_status = "ON" if bln_cam_mouse_control else "OFF"
+        status = f"[status] fps: {fps:.1f}, mouse control: {control_status}"
+        if POWER_SAVING and power_state["idle"]:
+            status += ", power saving: idle"
         if USE_MENU_SYSTEM:
-            menu_status = "MENU SYSTEM: CONNECTED" if menu_socket else "MENU SYSTEM: DISCONNECTED"
-            menu_status_color = (0, 255, 0) if menu_socket else (0, 0, 255)
-            cv2.putText(frame, menu_status, (frame_w - 300, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, menu_status_color, 2)
+            status += f", menu system: {'CONNECTED' if menu_socket else 'DISCONNECTED'}"
+            if menu_client["dropped"]:
+                status += f", dropped menu commands: {menu_client['dropped']}"
+        if last_action:
+            status += f", last action: {last_action} ({now - last_action_time:.0f}s ago)"
+        print(status)
+
+
+# ============ METRICS ============
+def build_metrics_snapshot(fps):
+    """Collects statistics of all stages measured so far"""
+    stages = {}
+    for stage in METRICS_STAGES:
+        stats = stage_statistics(stage)
+        if stats is not None:
+            stages[stage] = stats
+    return {
+        "timestamp": time.time(),
+        "fps": fps,
+        "frame_budget_ms": METRICS_FRAME_BUDGET_MS,
+        "captured_frames": captured_frames,
+        "processed_frames": processed_frames,
+        "menu_dropped_commands": menu_client["dropped"],
+        "stages": stages
+    }
 
-        current_time = time.time()
-        if last_action and (current_time - last_action_time) < LAST_ACTION_DISPLAY_TIME:
-            cv2.putText(frame, f"Last action: {last_action}", (frame_w - 500, frame_h - 60), cv2.FONT_HERSHEY_SIMPLEX,
-                        0.7, (0, 255, 255), 2)
 
-    cv2.imshow('Gagarin Data Labs -> AbleMouse AI edition', frame)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+def write_metrics_file(path):
+    """Writes the snapshot to a temporary file first, so readers never see a half-written file"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(metrics_snapshot, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def metrics_loop():
+    """Metrics stage: refreshes metrics_snapshot every METRICS_UPDATE_INTERVAL seconds"""
+    global metrics_snapshot
+    last_frames = processed_frames
+    last_time = time.time()
+    while not stop_event.wait(METRICS_UPDATE_INTERVAL):
+        now = time.time()
+        fps = (processed_frames - last_frames) / (now - last_time)
+        last_frames, last_time = processed_frames, now
+
+        metrics_snapshot = build_metrics_snapshot(fps)
+        if METRICS_FILE:
+            try:
+                write_metrics_file(METRICS_FILE)
+            except OSError as e:
+                print(f"Could not write metrics file: {e}")
+
+
+def start_metrics_endpoint(port):
+    """Serves the latest metrics snapshot as JSON on http://127.0.0.1:<port>/metrics"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = json.dumps(metrics_snapshot).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # do not print every request to the console
 
-if USE_MENU_SYSTEM:
-    disconnect_from_menu()
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    except OSError as e:
+        print(f"Could not start metrics endpoint on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics: http://127.0.0.1:{port}/metrics")
+    return server
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="AbleMouse AI edition - control the mouse pointer with your face")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without preview window and overlay drawing (status is printed to the log)")
+    parser.add_argument("--record", metavar="DIR",
+                        help="save camera frames, their timestamps and landmarks to DIR")
+    parser.add_argument("--replay", metavar="SOURCE",
+                        help="use a recording directory, a video file or 'synthetic' instead of the camera")
+    parser.add_argument("--replay-landmarks", action="store_true",
+                        help="replay landmarks.jsonl of the recording (skips face mesh)")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="learn eye and mouth thresholds for the current user and save them to the config")
+    parser.add_argument("--calibrate-mapping", action="store_true",
+                        help="learn how far the user moves the head to reach the screen edges and save it to the config")
+    parser.add_argument("--fast", action="store_true",
+                        help="replay as fast as possible without dropping frames instead of the recorded pace")
+    return parser.parse_args()
+
+
+def main():
+    """Main program: starts capture and processing threads and runs the display stage"""
+    global HEADLESS, face_mesh, input_backend, bln_cam_mouse_control
+
+    args = parse_arguments()
+    if args.headless:
+        HEADLESS = True
+
+    if args.calibrate and GESTURE_SIGNALS is not DEFAULT_GESTURE_SIGNALS:
+        print("Calibration sets the thresholds of the default gesture signals, leave gestures.signals empty")
+        exit()
+
+    if USE_MENU_SYSTEM:
+        start_menu_client()
+
+    capture_stage, capture_args, cap = open_frame_source(args.replay, args.replay_landmarks, not args.fast)
+    if capture_stage is None:
+        print("Cannot open camera" if args.replay is None else f"Cannot open {args.replay}")
+        exit()
+
+    if args.record and args.replay is None:
+        start_recording(args.record, cap)
+
+    face_mesh = mp.solutions.face_mesh.FaceMesh(refine_landmarks=True)
+    input_backend = create_input_backend(INPUT_BACKEND)
+    print(f"Input backend: {input_backend['name']}")
+
+    capture_thread = threading.Thread(target=capture_stage, args=capture_args, daemon=True)
+    vision_thread = threading.Thread(target=vision_loop, daemon=True)
+    capture_thread.start()
+    vision_thread.start()
+
+    cursor_thread = None
+    if USE_CURSOR_THREAD:
+        cursor_thread = threading.Thread(target=cursor_output_loop, daemon=True)
+        cursor_thread.start()
+
+    calibration_thread = None
+    if args.calibrate:
+        calibration_thread = threading.Thread(target=calibration_loop, daemon=True, args=(
+            OPENNESS_CALIBRATION_PHASES, measure_openness, compute_calibrated_thresholds, "eye_and_mouth"))
+    elif args.calibrate_mapping:
+        calibration_thread = threading.Thread(target=calibration_loop, daemon=True, args=(
+            MAPPING_CALIBRATION_PHASES, mapping_features, compute_calibrated_mapping, "mapping"))
+    if calibration_thread:
+        bln_cam_mouse_control = False
+        calibration_thread.start()
+
+    if SCREEN_REFRESH_INTERVAL > 0:
+        threading.Thread(target=screen_geometry_loop, daemon=True).start()
+
+    metrics_server = None
+    if SHOW_METRICS_OVERLAY or METRICS_ENDPOINT_PORT or METRICS_FILE:
+        threading.Thread(target=metrics_loop, daemon=True).start()
+        if METRICS_ENDPOINT_PORT:
+            metrics_server = start_metrics_endpoint(METRICS_ENDPOINT_PORT)
 
-cv2.destroyAllWindows()
-cap.release()
\ No newline at end of file
+    try:
+        if HEADLESS:
+            print("Running headless. Press Ctrl+C to stop")
+            status_log_loop()
+        else:
+            display_loop()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        vision_thread.join(timeout=2.0)
+        capture_thread.join(timeout=2.0)
+        if cursor_thread:
+            cursor_thread.join(timeout=2.0)
+        if calibration_thread:
+            calibration_thread.join(timeout=2.0)
+
+        if menu_client_thread:
+            menu_client_thread.join(timeout=2.0)
+
+        if metrics_server:
+            metrics_server.shutdown()
+
+        stop_recording()
+
+        if not HEADLESS:
+            cv2.destroyAllWindows()
+        if cap:
+            cap.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark of the AbleMouse AI edition tracking pipeline on a recorded or synthetic session.
+
+Runs the capture, vision and (optionally) cursor stages without a preview window and reports
+per-stage timings and camera-to-cursor latency. The cursor is not moved unless --move-cursor is set.
+
+    python able_mouse_ai_edition.py --record session1           # record a session first
+    python benchmark_ai_edition.py --replay session1            # full pipeline incl. face mesh
+    python benchmark_ai_edition.py --replay session1 --landmarks --fast
+    python benchmark_ai_edition.py --replay synthetic --frames 3000
+"""
+import argparse
+import threading
+import time
+
+import mediapipe as mp
+
+import able_mouse_ai_edition as ablemouse
+
+# keep every measurement of the run, not only the rolling window used by the live metrics
+TIMING_HISTORY = 1000000
+
+
+def run_pipeline(args):
+    """Runs the pipeline until the replay ends. Returns the wall time in seconds"""
+    capture_stage, capture_args, cap = ablemouse.open_frame_source(
+        args.replay, args.landmarks, not args.fast, args.frames)
+    if capture_stage is None:
+        raise SystemExit(f"Cannot open {args.replay}")
+
+    ablemouse.HEADLESS = True
+    ablemouse.STAGE_TIMING_HISTORY = TIMING_HISTORY
+    ablemouse.bln_cam_mouse_control = True
+    ablemouse.face_mesh = mp.solutions.face_mesh.FaceMesh(refine_landmarks=True)
+    ablemouse.input_backend = ablemouse.create_input_backend(args.backend)
+
+    threads = [threading.Thread(target=capture_stage, args=capture_args, daemon=True),
+               threading.Thread(target=ablemouse.vision_loop, daemon=True)]
+    if ablemouse.USE_CURSOR_THREAD:
+        threads.append(threading.Thread(target=ablemouse.cursor_output_loop, daemon=True))
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    try:
+        while not ablemouse.stop_event.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        ablemouse.stop_event.set()
+    for thread in threads:
+        thread.join(timeout=1.0)
+
+    if cap:
+        cap.release()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-stage timings of the AbleMouse AI edition pipeline")
+    parser.add_argument("--replay", default="synthetic",
+                        help="recording directory, video file or 'synthetic' (default)")
+    parser.add_argument("--landmarks", action="store_true",
+                        help="replay landmarks.jsonl of the recording (skips face mesh)")
+    parser.add_argument("--fast", action="store_true",
+                        help="process every frame as fast as possible instead of the recorded pace")
+    parser.add_argument("--frames", type=int, default=1800, help="length of the synthetic session")
+    parser.add_argument("--backend", default="none",
+                        help="input backend for cursor moves (default: none, the cursor stays still)")
+    parser.add_argument("--move-cursor", action="store_const", dest="backend", const=ablemouse.INPUT_BACKEND,
+                        help="use the backend from the configuration file")
+    args = parser.parse_args()
+
+    elapsed = run_pipeline(args)
+
+    print()
+    print(f"{'stage':<14}{'count':>8}{'mean, ms':>12}{'p50, ms':>12}{'p99, ms':>12}{'max, ms':>12}")
+    for stage in ablemouse.METRICS_STAGES:
+        stats = ablemouse.stage_statistics(stage)
+        if stats is None:
+            continue
+        print(f"{stage:<14}{stats['count']:>8}{stats['mean']:>12.2f}{stats['p50']:>12.2f}"
+              f"{stats['p99']:>12.2f}{stats['max']:>12.2f}")
+
+    captured = ablemouse.captured_frames
+    processed = ablemouse.processed_frames
+    print()
+    print(f"Frames: {captured} captured, {processed} processed, {captured - processed} dropped")
+    print(f"Processing rate: {processed / elapsed:.1f} fps over {elapsed:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark of cursor move latency for the input backends of AbleMouse AI edition.
+
+Moves the pointer back and forth by a few pixels around its current position and reports
+per-call time of every backend available on this machine. Backends that do not wait for the
+display server (xlib) are synced after every move, so all of them do the same amount of work;
+--no-sync measures the plain move as the tracker does it.
+
+    python benchmark_input_backend.py
+    python benchmark_input_backend.py --moves 5000 --backends pyautogui win32
+"""
+import argparse
+import time
+
+import pyautogui
+
+import able_mouse_ai_edition as ablemouse
+
+
+def percentile(sorted_values, share):
+    index = min(len(sorted_values) - 1, int(share * len(sorted_values)))
+    return sorted_values[index]
+
+
+def benchmark_backend(name, moves, sync):
+    """Returns sorted per-call durations (microseconds) of the backend's move function"""
+    backend = ablemouse.INPUT_BACKENDS[name]()
+    sync_backend = backend.get("sync") if sync else None
+    start_x, start_y = pyautogui.position()
+
+    durations = []
+    for i in range(moves):
+        x = start_x + (i % 2) * 3
+        t0 = time.perf_counter()
+        backend["move"](x, start_y)
+        if sync_backend:
+            sync_backend()
+        durations.append((time.perf_counter() - t0) * 1e6)
+
+    backend["move"](start_x, start_y)
+    durations.sort()
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cursor move latency of input backends")
+    parser.add_argument("--moves", type=int, default=2000, help="number of moves per backend")
+    parser.add_argument("--backends", nargs="*", default=[name for name in ablemouse.INPUT_BACKENDS if name != "none"],
+                        help="backends to compare (default: all that move the cursor)")
+    parser.add_argument("--no-sync", dest="sync", action="store_false",
+                        help="do not wait for the display server after a move (xlib)")
+    args = parser.parse_args()
+
+    print(f"{'backend':<12}{'mean, us':>12}{'p50, us':>12}{'p99, us':>12}{'max, us':>12}")
+    for name in args.backends:
+        try:
+            durations = benchmark_backend(name, args.moves, args.sync)
+        except Exception as e:
+            print(f"{name:<12}not available: {e}")
+            continue
+
+        mean = sum(durations) / len(durations)
+        print(f"{name:<12}{mean:>12.1f}{percentile(durations, 0.5):>12.1f}"
+              f"{percentile(durations, 0.99):>12.1f}{durations[-1]:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
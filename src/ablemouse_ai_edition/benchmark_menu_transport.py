@@ -0,0 +1,135 @@
+"""
+Micro-benchmark of command round-trip latency between AbleMouse AI edition and the menu server.
+
+Sends a command, waits for its acknowledgement and repeats, for every transport available on this
+machine. By default the commands go to a small acknowledging server started inside the benchmark,
+so only the transport is measured. With --server they go to a running AbleMouse Beyond Switch
+server instead (tcp and unix only, the server does not acknowledge udp commands).
+
+    python benchmark_menu_transport.py
+    python benchmark_menu_transport.py --commands 5000 --transports tcp unix
+    python benchmark_menu_transport.py --server --transports unix
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+
+import able_mouse_ai_edition as ablemouse
+
+
+def percentile(sorted_values, share):
+    index = min(len(sorted_values) - 1, int(share * len(sorted_values)))
+    return sorted_values[index]
+
+
+def acknowledge(message):
+    command_data = json.loads(message)
+    return (json.dumps({"status": "received", "command": command_data["command"], "id": command_data["id"]})
+            + "\n").encode('utf-8')
+
+
+def serve_stream(server_socket):
+    """Acknowledges every line of the first client"""
+    client_socket, _ = server_socket.accept()
+    buffer = b""
+    while True:
+        data = client_socket.recv(4096)
+        if not data:
+            break
+        buffer += data
+        *messages, buffer = buffer.split(b"\n")
+        for message in messages:
+            client_socket.sendall(acknowledge(message))
+    client_socket.close()
+
+
+def serve_datagrams(server_socket):
+    """Acknowledges every datagram until the benchmark ends"""
+    while True:
+        try:
+            data, address = server_socket.recvfrom(65536)
+        except OSError:
+            break
+        server_socket.sendto(acknowledge(data), address)
+
+
+def start_benchmark_server(transport):
+    """Starts an acknowledging server on a free port or socket path. Returns its socket"""
+    if transport == "udp":
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.bind(("localhost", 0))
+        ablemouse.MENU_HOST, ablemouse.MENU_PORT = server_socket.getsockname()
+        threading.Thread(target=serve_datagrams, args=(server_socket,), daemon=True).start()
+        return server_socket
+
+    if transport == "unix":
+        ablemouse.MENU_SOCKET_PATH = f"/tmp/ablemouse_benchmark_{os.getpid()}.sock"
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(ablemouse.MENU_SOCKET_PATH)
+    else:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.bind(("localhost", 0))
+        ablemouse.MENU_HOST, ablemouse.MENU_PORT = server_socket.getsockname()
+    server_socket.listen(1)
+    threading.Thread(target=serve_stream, args=(server_socket,), daemon=True).start()
+    return server_socket
+
+
+def benchmark_transport(transport, commands, use_server):
+    """Returns sorted round-trip durations (microseconds) of the transport"""
+    ablemouse.MENU_TRANSPORT = transport
+    server_socket = None if use_server else start_benchmark_server(transport)
+    if not ablemouse.connect_to_menu():
+        raise RuntimeError("cannot connect")
+
+    durations = []
+    buffer = b""
+    try:
+        for i in range(commands):
+            t0 = time.perf_counter()
+            ablemouse.menu_socket.sendall((json.dumps({"id": i, "command": "ping"}) + "\n").encode('utf-8'))
+            while b"\n" not in buffer:
+                buffer += ablemouse.menu_socket.recv(4096)
+            _, buffer = buffer.split(b"\n", 1)
+            durations.append((time.perf_counter() - t0) * 1e6)
+    finally:
+        ablemouse.disconnect_from_menu()
+        if server_socket:
+            server_socket.close()
+            if transport == "unix":
+                os.remove(ablemouse.MENU_SOCKET_PATH)
+
+    durations.sort()
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare command round-trip latency of menu transports")
+    parser.add_argument("--commands", type=int, default=2000, help="number of commands per transport")
+    parser.add_argument("--transports", nargs="*", default=["tcp", "unix", "udp"],
+                        help="transports to compare (default: all)")
+    parser.add_argument("--server", action="store_true",
+                        help="send to a running AbleMouse Beyond Switch server (address from the configuration file)")
+    args = parser.parse_args()
+
+    print(f"{'transport':<12}{'mean, us':>12}{'p50, us':>12}{'p99, us':>12}{'max, us':>12}")
+    for transport in args.transports:
+        if transport == "unix" and not hasattr(socket, "AF_UNIX"):
+            print(f"{transport:<12}not available: no Unix domain sockets on this system")
+            continue
+        try:
+            durations = benchmark_transport(transport, args.commands, args.server)
+        except Exception as e:
+            print(f"{transport:<12}not available: {e}")
+            continue
+
+        mean = sum(durations) / len(durations)
+        print(f"{transport:<12}{mean:>12.1f}{percentile(durations, 0.5):>12.1f}"
+              f"{percentile(durations, 0.99):>12.1f}{durations[-1]:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,11 @@ from enum import Enum
 # Server configuration
 SERVER_CONFIG = {
     "host": "localhost",
-    "port": 12345
+    "port": 12345,
+    # "tcp", "unix" - Unix domain socket (Linux/macOS, lowest latency on the same machine)
+    # or "udp" - one datagram per command, no acknowledgement
+    "transport": "tcp",
+    "socket_path": "/tmp/ablemouse_menu.sock"
 }
 
 # Interface settings
@@ -105,5 +109,6 @@ class _UI(str, Enum):
     TRANSPARENCY = "Transparency"
     SERVER_STATUS = "Server Status: RUNNING"
     PORT = "Port"
+    SOCKET = "Socket"
     def __str__(self) -> str:
         return self.value
@@ -0,0 +1,102 @@
+"""
+Benchmark of menu transition time of AbleMouse Beyond Switch edition.
+
+Opens every menu of the menu configuration in turn and reports how long update_menu takes,
+including the layout of the window. With --recreate the previous approach is measured instead:
+all buttons are destroyed and created again on every transition.
+
+    python benchmark_menu_transitions.py
+    python benchmark_menu_transitions.py --rounds 20 --recreate
+"""
+import argparse
+import time
+import tkinter as tk
+from tkinter import ttk
+
+import app_config
+
+# do not clash with a running menu server
+app_config.SERVER_CONFIG["transport"] = "tcp"
+app_config.SERVER_CONFIG["port"] = 0
+
+import main as menu_app
+
+
+def percentile(sorted_values, share):
+    index = min(len(sorted_values) - 1, int(share * len(sorted_values)))
+    return sorted_values[index]
+
+
+def recreate_menu(app):
+    """update_menu as it was before the button pool: destroys all buttons and creates new ones"""
+    menu_config = app.menu_config[app.current_menu]
+    app.title_label.config(text=menu_config["title"])
+    app.title_label.configure(style=menu_config["title_style"])
+
+    for widget in app.menu_frame.winfo_children():
+        widget.destroy()
+
+    app.buttons = []
+    for i, item_config in enumerate(menu_config["items"]):
+        btn = ttk.Button(app.menu_frame,
+                         text=item_config["text"],
+                         style='Normal.TButton' if i != 0 else 'Highlight.TButton',
+                         command=lambda config=item_config: app.execute_action(config))
+        btn.pack(fill=tk.X, pady=1 if app.current_menu == "cursor" else 2)
+        app.buttons.append(btn)
+
+    app.highlight_index = 0
+    app.update_highlight()
+
+
+def benchmark_transitions(app, rounds, update):
+    """Returns menu name -> sorted transition durations (milliseconds)"""
+    durations = {name: [] for name in app.menu_config}
+    for _ in range(rounds):
+        for name in app.menu_config:
+            app.current_menu = name
+            t0 = time.perf_counter()
+            update(app)
+            app.root.update_idletasks()  # geometry and redraw of the new menu
+            durations[name].append((time.perf_counter() - t0) * 1000)
+
+    for values in durations.values():
+        values.sort()
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure menu transition time of the graphic menu")
+    parser.add_argument("--rounds", type=int, default=10, help="how many times every menu is opened")
+    parser.add_argument("--recreate", action="store_true",
+                        help="destroy and create the buttons on every transition (the previous approach)")
+    parser.add_argument("--show", type=int, default=10, help="number of the largest menus to list")
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    root.geometry(app_config.UI_CONFIG["window_size"])
+    app = menu_app.GraphicMenuServer(root)
+    app.highlight_interval = 3600  # keep the automatic highlight out of the measurement
+    root.update()
+
+    update = recreate_menu if args.recreate else menu_app.GraphicMenuServer.update_menu
+    durations = benchmark_transitions(app, args.rounds, update)
+
+    print(f"{'menu':<24}{'items':>8}{'mean, ms':>12}{'p50, ms':>12}{'max, ms':>12}")
+    largest = sorted(durations, key=lambda name: len(app.menu_config[name]["items"]), reverse=True)
+    for name in largest[:args.show]:
+        values = durations[name]
+        print(f"{name:<24}{len(app.menu_config[name]['items']):>8}{sum(values) / len(values):>12.2f}"
+              f"{percentile(values, 0.5):>12.2f}{values[-1]:>12.2f}")
+
+    all_values = sorted(value for values in durations.values() for value in values)
+    print()
+    print(f"All transitions: {len(all_values)}, mean {sum(all_values) / len(all_values):.2f} ms, "
+          f"p50 {percentile(all_values, 0.5):.2f} ms, p99 {percentile(all_values, 0.99):.2f} ms, "
+          f"max {all_values[-1]:.2f} ms")
+
+    app.exit_app()
+
+
+if __name__ == "__main__":
+    main()
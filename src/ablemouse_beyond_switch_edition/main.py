@@ -9,12 +9,24 @@ import subprocess
 import pygame
 import socket
 import json
+import codecs
 import pyautogui
-import queue
+import asyncio
 
 from menu_config import MENU_CONFIG
 from app_config import AUDIO_CONFIG, SERVER_CONFIG, UI_CONFIG, STYLE_CONFIG, _UI
 
+# Version of the command protocol. A client announces its version with the "hello" command and
+# both sides use the lower one. Clients that never say hello are served as version 0.
+# 1 - select_current_item
+# 2 - next_item, previous_item, highlight_item, go_back, go_home, open_menu, get_state
+# 3 - subscribe, unsubscribe: the server pushes highlight, menu and action events
+PROTOCOL_VERSION = 3
+# Events a client can subscribe to
+EVENT_TYPES = ("highlight", "menu", "action")
+# A client that sends this much without a complete message is sending garbage
+MAX_MESSAGE_SIZE = 65536
+
 
 class GraphicMenuServer:
     def __init__(self, root):
@@ -46,14 +58,19 @@ class GraphicMenuServer:
 
         # Server settings
         self.server_socket = None
+        self.server_loop = None
         self.server_running = True
+        self.server_transport = self.server_config["transport"]
+        if self.server_transport == "unix" and not hasattr(socket, "AF_UNIX"):
+            print("Unix domain sockets are not supported on this system, using TCP")
+            self.server_transport = "tcp"
         self.client_connections = []
+        # writer -> event types the client subscribed to, used only in the server thread
+        self.subscribers = {}
 
-        # Queue for commands from clients
-        self.command_queue = queue.Queue()
-
-        # Button widgets cache
+        # Button widgets cache: buttons of the current menu and all buttons created so far
         self.buttons = []
+        self.button_pool = []
 
         # Create styles
         self.setup_styles()
@@ -68,9 +85,6 @@ class GraphicMenuServer:
         # Start server
         self.start_server()
 
-        # Start command handler
-        self.start_command_handler()
-
         # Key bindings
         self.root.bind('<space>', self.select_item)
         self.root.bind('<Up>', lambda e: self.move_highlight(-1))
@@ -174,8 +188,12 @@ class GraphicMenuServer:
         self.server_status_label.pack(side=tk.LEFT)
 
         # Server port
+        if self.server_transport == "unix":
+            address_text = f"{_UI.SOCKET}: {self.server_config['socket_path']}"
+        else:
+            address_text = f"{_UI.PORT}: {self.server_config['port']} {self.server_transport.upper()}"
         ttk.Label(status_frame,
-                  text=f"{_UI.PORT}: {self.server_config['port']}",
+                  text=address_text,
                   font=('Arial', 9)).pack(side=tk.RIGHT)
 
     def update_menu(self):
@@ -192,19 +210,30 @@ class GraphicMenuServer:
             self.title_label.config(text=menu_config["title"])
             self.title_label.configure(style=menu_config["title_style"])
 
-            # Clear current menu
-            for widget in self.menu_frame.winfo_children():
-                widget.destroy()
-
-            # Create buttons based on configuration
-            self.buttons = []
-            for i, item_config in enumerate(menu_config["items"]):
-                btn = ttk.Button(self.menu_frame,
-                                 text=item_config["text"],
-                                 style='Normal.TButton' if i != 0 else 'Highlight.TButton',
-                                 command=lambda config=item_config: self.execute_action(config))
-                btn.pack(fill=tk.X, pady=1 if self.current_menu == "cursor" else 2)
-                self.buttons.append(btn)
+            # Reuse the buttons of the previous menu instead of destroying and creating them:
+            # reconfiguring a button is much cheaper and the window does not flicker.
+            # The shown buttons are always the first ones of the pool, so packing order is kept.
+            items = menu_config["items"]
+            pady = 1 if self.current_menu == "cursor" else 2
+            while len(self.button_pool) < len(items):
+                self.button_pool.append(ttk.Button(self.menu_frame))
+
+            for i, btn in enumerate(self.button_pool):
+                if i < len(items):
+                    item_config = items[i]
+                    btn.configure(text=item_config["text"],
+                                  style='Normal.TButton' if i != 0 else 'Highlight.TButton',
+                                  command=lambda config=item_config: self.execute_action(config))
+                    if btn.winfo_manager():
+                        btn.pack_configure(pady=pady)
+                    else:
+                        btn.pack(fill=tk.X, pady=pady)
+                elif btn.winfo_manager():
+                    btn.pack_forget()
+
+            self.buttons = self.button_pool[:len(items)]
+
+            self.publish_event({"event": "menu", "menu": self.current_menu, "title": str(menu_config["title"])})
 
             # Reset highlight index
             self.highlight_index = 0
@@ -294,6 +323,7 @@ class GraphicMenuServer:
             return
 
         action_type = action_config.get("action", "")
+        self.publish_event({"event": "action", "action": action_type, "text": str(action_config.get("text", ""))})
 
         try:
             if action_type == "open_menu":
@@ -462,9 +492,33 @@ class GraphicMenuServer:
                     btn.configure(style='Highlight.TButton')
                 else:
                     btn.configure(style='Normal.TButton')
+
+            if self.subscribers:
+                item = self.menu_config[self.current_menu]["items"][self.highlight_index]
+                self.publish_event({"event": "highlight", "menu": self.current_menu,
+                                    "index": self.highlight_index, "text": str(item["text"])})
         except Exception as e:
             print(f"Error in update_highlight: {e}")
 
+    def step_highlight(self, direction):
+        """Move the highlight to the next or previous item, wrapping around like the highlight cycle"""
+        if not self.running or not self.buttons:
+            return
+
+        self.highlight_index = (self.highlight_index + direction) % len(self.buttons)
+        self.update_highlight()
+
+    def highlight_item(self, index):
+        """Highlight the item with the given index of the current menu"""
+        if not self.running or not self.buttons:
+            return
+
+        if 0 <= index < len(self.buttons):
+            self.highlight_index = index
+            self.update_highlight()
+        else:
+            print(f"No item {index} in menu {self.current_menu}")
+
     def move_highlight(self, direction):
         """Manual highlight movement"""
         if not self.running or not self.buttons:
@@ -527,107 +581,190 @@ class GraphicMenuServer:
         return "\n".join(info_lines)
 
     def start_server(self):
-        """Start server for receiving commands from computer vision system"""
+        """Start server for receiving commands from computer vision system.
+
+        One asyncio event loop in a background thread serves every client; it sleeps until
+        a client connects or sends data, there is no thread per client and no polling.
+        """
+        self.server_loop = asyncio.new_event_loop()
 
         def server_thread():
+            asyncio.set_event_loop(self.server_loop)
             try:
-                self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                self.server_socket.bind((self.server_config['host'], self.server_config['port']))
-                self.server_socket.listen(5)
-                self.server_socket.settimeout(1.0)
-
-                print(f"Menu server started on port {self.server_config['port']}")
-
-                while self.server_running:
-                    try:
-                        client_socket, address = self.server_socket.accept()
-                        print(f"Client connected: {address}")
-
-                        client_thread = threading.Thread(
-                            target=self.handle_client,
-                            args=(client_socket, address),
-                            daemon=True
-                        )
-                        client_thread.start()
-
-                    except socket.timeout:
-                        continue
-                    except Exception as e:
-                        if self.server_running:
-                            print(f"Accept error: {e}")
-
+                self.server_socket = self.server_loop.run_until_complete(self.open_server())
             except Exception as e:
                 print(f"Failed to start server: {e}")
+                self.server_loop.close()
+                return
+
+            self.server_loop.run_forever()
+
+            # exit_app stopped the loop: stop listening and let every client handler finish
+            self.server_socket.close()
+            pending = asyncio.all_tasks(self.server_loop)
+            for task in pending:
+                task.cancel()
+            self.server_loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.server_loop.close()
 
         server_thread_instance = threading.Thread(target=server_thread, daemon=True)
         server_thread_instance.start()
 
-    def handle_client(self, client_socket, address):
+    async def open_server(self):
+        """Open the listening socket of the configured transport"""
+        if self.server_transport == "udp":
+            transport, _ = await self.server_loop.create_datagram_endpoint(
+                lambda: CommandDatagramProtocol(self),
+                local_addr=(self.server_config['host'], self.server_config['port']))
+            print(f"Menu server started on UDP port {self.server_config['port']}")
+            return transport
+
+        if self.server_transport == "unix":
+            socket_path = self.server_config['socket_path']
+            if os.path.exists(socket_path):
+                os.remove(socket_path)  # left over from a previous run
+            server = await asyncio.start_unix_server(self.handle_client, socket_path)
+            print(f"Menu server started on {socket_path}")
+            return server
+
+        server = await asyncio.start_server(self.handle_client, self.server_config['host'],
+                                            self.server_config['port'], reuse_address=True)
+        print(f"Menu server started on port {self.server_config['port']}")
+        return server
+
+    async def handle_client(self, reader, writer):
         """Handle client connection"""
-        try:
-            client_socket.settimeout(5.0)
+        address = writer.get_extra_info('peername') or self.server_config['socket_path']
+        print(f"Client connected: {address}")
+        self.client_connections.append(writer)
+        decoder = MessageDecoder(address)
 
+        try:
             while self.server_running:
-                try:
-                    data = client_socket.recv(1024)
-                    if not data:
-                        break
-
-                    try:
-                        command_data = json.loads(data.decode('utf-8'))
-                        command = command_data.get('command', '')
-
-                        print(f"Command received from {address}: {command}")
-
-                        self.command_queue.put((command, address))
-
-                        response = json.dumps({"status": "received", "command": command})
-                        client_socket.send(response.encode('utf-8'))
-
-                    except json.JSONDecodeError as e:
-                        print(f"JSON decoding error from {address}: {e}")
-                        continue
-
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    print(f"Read error from {address}: {e}")
+                data = await reader.read(4096)
+                if not data:
                     break
 
+                self.dispatch_commands(decoder.feed(data), address, writer)
+                await writer.drain()
+
+        except asyncio.CancelledError:
+            pass  # server shutdown, end the handler normally
         except Exception as e:
-            print(f"Error processing client {address}: {e}")
+            print(f"Read error from {address}: {e}")
         finally:
-            try:
-                client_socket.close()
-                print(f"Client disconnected: {address}")
-            except:
-                pass
-
-    def start_command_handler(self):
-        """Start command handler from queue"""
-
-        def command_handler():
-            while self.server_running:
-                try:
-                    command, address = self.command_queue.get(timeout=1.0)
-
-                    if not self.server_running:
-                        break
-
-                    if command == "select_current_item":
-                        self.root.after_idle(self.select_item_from_cv)
-
-                    self.command_queue.task_done()
-
-                except queue.Empty:
-                    continue
-                except Exception as e:
-                    if self.server_running:
-                        print(f"Command handler error: {e}")
-
-        command_thread = threading.Thread(target=command_handler, daemon=True)
-        command_thread.start()
+            self.client_connections.remove(writer)
+            self.subscribers.pop(writer, None)
+            writer.close()
+            print(f"Client disconnected: {address}")
+
+    def send_message(self, writer, message):
+        """Send one message to a client. Runs in the server thread; writer is None for UDP clients"""
+        if writer and not writer.is_closing():
+            writer.write((json.dumps(message, separators=(',', ':'), ensure_ascii=False) + "\n").encode('utf-8'))
+
+    def dispatch_commands(self, messages, address, writer):
+        """Run received commands in the UI thread and answer every one"""
+        for command_data in messages:
+            command = command_data.get('command', '')
+            print(f"Command received from {address}: {command}")
+
+            if command == "hello":
+                # handshake: answer with the protocol version both sides understand
+                client_version = command_data.get("protocol")
+                version = min(PROTOCOL_VERSION, client_version if isinstance(client_version, int) else 0)
+                print(f"Client {address} uses protocol version {version}")
+                self.send_message(writer, {"status": "hello", "protocol": version, "server": "AbleMouse Beyond Switch"})
+                continue
+
+            if command == "get_state":
+                # read in the UI thread, after the commands received before it have run
+                self.root.after_idle(self.send_state, writer, command_data.get("id"))
+                continue
+
+            if command in ("subscribe", "unsubscribe"):
+                error = self.update_subscription(command, command_data, writer)
+            else:
+                error = self.schedule_command(command, command_data)
+            if error:
+                print(f"Command from {address} rejected: {error}")
+                response = {"status": "error", "command": command, "error": error}
+            else:
+                response = {"status": "received", "command": command}
+            if "id" in command_data:
+                response["id"] = command_data["id"]
+            self.send_message(writer, response)
+
+    def update_subscription(self, command, command_data, writer):
+        """Subscribe a client to events or unsubscribe it. Returns an error text if the command is invalid"""
+        if writer is None:
+            return "events need a stream connection (tcp or unix)"
+        if command == "unsubscribe":
+            self.subscribers.pop(writer, None)
+            return None
+
+        events = command_data.get("events", list(EVENT_TYPES))
+        if not isinstance(events, list) or not set(events) <= set(EVENT_TYPES):
+            return f"events must be a list of {', '.join(EVENT_TYPES)}"
+        self.subscribers[writer] = set(events)
+        return None
+
+    def publish_event(self, event):
+        """Push an event to the subscribed clients. Called from the UI thread"""
+        if self.subscribers and self.server_loop:
+            self.server_loop.call_soon_threadsafe(self.push_event, event)
+
+    def push_event(self, event):
+        """Send an event to every client subscribed to its type. Runs in the server thread"""
+        for writer, events in list(self.subscribers.items()):
+            if event["event"] not in events:
+                continue
+            # a client that does not read its events loses them instead of filling the memory
+            if writer.transport.get_write_buffer_size() > MAX_MESSAGE_SIZE:
+                continue
+            self.send_message(writer, event)
+
+    def schedule_command(self, command, command_data):
+        """Schedule a menu command in the UI thread. Returns an error text if the command is invalid"""
+        if command == "select_current_item":
+            self.root.after_idle(self.select_item_from_cv)
+        elif command == "next_item":
+            self.root.after_idle(self.step_highlight, 1)
+        elif command == "previous_item":
+            self.root.after_idle(self.step_highlight, -1)
+        elif command == "highlight_item":
+            index = command_data.get("index")
+            if not isinstance(index, int):
+                return "highlight_item needs an integer \"index\""
+            self.root.after_idle(self.highlight_item, index)
+        elif command == "go_back":
+            self.root.after_idle(self.go_back)
+        elif command == "go_home":
+            self.root.after_idle(self.go_to_main_menu)
+        elif command == "open_menu":
+            menu_name = command_data.get("menu")
+            if menu_name not in self.menu_config:
+                return f"unknown menu: {menu_name}"
+            self.root.after_idle(self.execute_action, {"action": "open_menu", "menu": menu_name})
+        else:
+            return f"unknown command: {command}"
+        return None
+
+    def send_state(self, writer, message_id):
+        """Answer get_state with the current menu, its items, the highlighted item and the history"""
+        menu_config = self.menu_config[self.current_menu]
+        response = {
+            "status": "state",
+            "command": "get_state",
+            "menu": self.current_menu,
+            "title": str(menu_config["title"]),
+            "items": [str(item["text"]) for item in menu_config["items"]],
+            "highlight_index": self.highlight_index,
+            "history": list(self.menu_history)
+        }
+        if message_id is not None:
+            response["id"] = message_id
+        self.server_loop.call_soon_threadsafe(self.send_message, writer, response)
 
     def select_item_from_cv(self):
         """Select current menu item by command from computer vision system"""
@@ -690,10 +827,12 @@ class GraphicMenuServer:
         self.running = False
         self.server_running = False
 
-        if self.server_socket:
+        if self.server_loop:
             try:
-                self.server_socket.close()
-                print("Server socket closed")
+                self.server_loop.call_soon_threadsafe(self.server_loop.stop)
+                if self.server_transport == "unix" and self.server_socket:
+                    os.remove(self.server_config['socket_path'])
+                print("Server stopped")
             except Exception as e:
                 print(f"Error closing server socket: {e}")
 
@@ -703,17 +842,6 @@ class GraphicMenuServer:
         except Exception as e:
             print(f"Error stopping pygame mixer: {e}")
 
-        try:
-            while not self.command_queue.empty():
-                try:
-                    self.command_queue.get_nowait()
-                    self.command_queue.task_done()
-                except:
-                    break
-            print("Command queue cleared")
-        except Exception as e:
-            print(f"Error clearing queue: {e}")
-
         time.sleep(0.1)
 
         try:
@@ -731,6 +859,64 @@ class GraphicMenuServer:
         self.exit_app()
 
 
+class MessageDecoder:
+    """Splits the byte stream of one client into JSON commands.
+
+    Commands are JSON objects separated by newlines; several may arrive in one read and one
+    may be split between reads. Objects sent back to back without a newline (older clients)
+    are decoded as well.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+
+    def feed(self, data):
+        """Adds received bytes. Returns the complete commands (dicts) in order"""
+        self.buffer += self.text_decoder.decode(data)
+        buffer = self.buffer
+        messages = []
+        position = 0
+
+        while True:
+            # skip separators between messages
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                message, position = self.json_decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                line_end = buffer.find("\n", position)
+                if line_end < 0:
+                    break  # the rest of the message has not arrived yet
+                print(f"JSON decoding error from {self.address}: {e}")
+                position = line_end + 1
+                continue
+            if isinstance(message, dict):
+                messages.append(message)
+            else:
+                print(f"Ignoring message from {self.address}: not a JSON object")
+
+        self.buffer = buffer[position:]
+        if len(self.buffer) > MAX_MESSAGE_SIZE:
+            print(f"Message from {self.address} is too long, dropped")
+            self.buffer = ""
+        return messages
+
+
+class CommandDatagramProtocol(asyncio.DatagramProtocol):
+    """Receives commands as UDP datagrams (one or more lines each). Nothing is sent back"""
+
+    def __init__(self, menu_server):
+        self.menu_server = menu_server
+
+    def datagram_received(self, data, address):
+        self.menu_server.dispatch_commands(MessageDecoder(address).feed(data), address, None)
+
+
 def main():
     """Main application launch function"""
     try: